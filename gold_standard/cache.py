@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+A compiled, columnar cache of the gold standard corpus.
+
+Parsing the XML files of the corpus takes a long time, so the data needed by
+most tools is compiled into a single binary file. String values (forms,
+lemmas, simple and detailed analyses, xml:ids) are interned into string
+tables; tokens, sentences, paragraphs and files are represented by integer
+arrays that index into them or into each other. The file is memory-mapped on
+load, so loading does not depend on the size of the corpus.
+
+The cache is rebuilt automatically if a source file is added, removed or
+changed (detected by its modification time, then by its SHA-1 hash).
+
+The cache also contains an inverted index: for each of the token fields in
+:data:`INDEXED_FIELDS`, the tokens are listed grouped by value (postings), in
+corpus order within each group.
+
+File layout: ``MAGIC``, the length of the header (8 bytes, little endian),
+the JSON header and the columns, each aligned to 8 bytes. The header lists
+the source files and the offset, length and typecode of each column.
+"""
+
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterator
+import hashlib
+import json
+import mmap
+from pathlib import Path
+import shutil
+import sys
+
+from gold_standard.tei import JOIN_VALUES, read_tei
+from gold_standard.utils import atomic_write
+
+
+MAGIC = b'GSCACHE1'
+FORMAT_VERSION = 2
+# Join code of tokens whose join attribute is missing or invalid
+NO_JOIN = 255
+# Index of missing values (e.g. when a token has no correct analysis)
+MISSING = -1
+
+# The interned string tables
+STRING_TABLES = ('files', 'forms', 'lemmas', 'simple', 'detailed', 'ids')
+# The integer columns and their typecodes
+COLUMNS = {
+    # Per token
+    'token_form': 'i', 'token_lemma': 'i', 'token_simple': 'i',
+    'token_detailed': 'i', 'token_id': 'i', 'token_join': 'B',
+    # Per sentence (offsets have an extra element at the end)
+    'sentence_offsets': 'i', 'sentence_id': 'i',
+    # Per paragraph, indexing sentences
+    'paragraph_offsets': 'i', 'paragraph_id': 'i',
+    # Per file, indexing paragraphs
+    'file_offsets': 'i',
+}
+# Token field -> the string table of its values. For each field, the index
+# has the columns {field}_postings (token indices) and
+# {field}_posting_offsets (where the postings of each value start)
+INDEXED_FIELDS = {'form': 'forms', 'lemma': 'lemmas', 'simple': 'simple',
+                  'detailed': 'detailed'}
+
+
+def cache_dir(corpus_dir: Path) -> Path:
+    """The directory where the caches of _corpus_dir_ are stored."""
+    return Path(corpus_dir) / '.cache'
+
+
+def corpus_files(corpus_dir: Path) -> list[Path]:
+    """The XML files of the corpus in a stable order."""
+    corpus_dir = Path(corpus_dir)
+    if not corpus_dir.is_dir():
+        raise NotADirectoryError(corpus_dir)
+    return sorted(corpus_dir.glob('**/*.xml'))
+
+
+def file_hash(file: Path) -> str:
+    """The SHA-1 hash of a file."""
+    h = hashlib.sha1()
+    with open(file, 'rb') as inf:
+        while chunk := inf.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StringTable:
+    """
+    An interned list of strings stored as a UTF-8 blob and an offset array.
+    Strings are only decoded when accessed.
+    """
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self._blob = blob
+        self._offsets = offsets
+        self._index = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str | None:
+        if i == MISSING:
+            return None
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def index(self, s: str) -> int:
+        """
+        The index of _s_, or ``MISSING`` if it is not in the table. The
+        lookup dictionary is built on first use.
+        """
+        if self._index is None:
+            self._index = {s: i for i, s in enumerate(self)}
+        return self._index.get(s, MISSING)
+
+
+class CorpusCache:
+    """
+    The loaded cache. The integer columns (see :data:`COLUMNS`) are available
+    as attributes (read-only memoryviews), and the string tables (see
+    :data:`STRING_TABLES`) as :class:`StringTable` objects.
+    """
+    def __init__(self, cache_file: Path):
+        with open(cache_file, 'rb') as inf:
+            self._mmap = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{cache_file} is not a corpus cache')
+        header_len = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], 'little')
+        data_start = len(MAGIC) + 8
+        self.header = json.loads(str(buffer[data_start:data_start + header_len], 'utf-8'))
+        if (self.header['version'] != FORMAT_VERSION or
+                self.header['byteorder'] != sys.byteorder):
+            raise ValueError(f'{cache_file} has an incompatible format')
+
+        columns = {}
+        for name, (offset, length, typecode) in self.header['columns'].items():
+            columns[name] = buffer[offset:offset + length].cast(typecode)
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+        self._postings = {field: (columns[f'{field}_posting_offsets'],
+                                  columns[f'{field}_postings'])
+                          for field in INDEXED_FIELDS}
+        for name in STRING_TABLES:
+            setattr(self, name, StringTable(columns[f'{name}_blob'],
+                                            columns[f'{name}_offsets']))
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.token_form)
+
+    @property
+    def num_sentences(self) -> int:
+        return len(self.sentence_id)
+
+    @property
+    def num_paragraphs(self) -> int:
+        return len(self.paragraph_id)
+
+    @property
+    def num_files(self) -> int:
+        return len(self.file_offsets) - 1
+
+    def genre(self, file_idx: int) -> str:
+        """The genre (the name of the subdirectory) of a file."""
+        return Path(self.files[file_idx]).parent.name
+
+    def file_sentences(self, file_idx: int) -> range:
+        """The indices of the sentences in a file."""
+        return range(self.paragraph_offsets[self.file_offsets[file_idx]],
+                     self.paragraph_offsets[self.file_offsets[file_idx + 1]])
+
+    def sentence_tokens(self, sent_idx: int) -> range:
+        """The indices of the tokens in a sentence."""
+        return range(self.sentence_offsets[sent_idx],
+                     self.sentence_offsets[sent_idx + 1])
+
+    def token_sentence(self, token_idx: int) -> int:
+        """The index of the sentence a token belongs to."""
+        return bisect_right(self.sentence_offsets, token_idx) - 1
+
+    def sentence_file(self, sent_idx: int) -> int:
+        """The index of the file a sentence belongs to."""
+        paragraph = bisect_right(self.paragraph_offsets, sent_idx) - 1
+        return bisect_right(self.file_offsets, paragraph) - 1
+
+    def file_tokens(self, file_idx: int) -> range:
+        """The indices of the tokens in a file."""
+        sents = self.file_sentences(file_idx)
+        return range(self.sentence_offsets[sents.start],
+                     self.sentence_offsets[sents.stop])
+
+    def postings(self, field: str, value_idx: int) -> memoryview:
+        """
+        The (ascending) indices of the tokens whose _field_ (see
+        :data:`INDEXED_FIELDS`) is the value_idx-th string in its table.
+        """
+        offsets, postings = self._postings[field]
+        if value_idx == MISSING:
+            return postings[0:0]
+        return postings[offsets[value_idx]:offsets[value_idx + 1]]
+
+    def close(self):
+        self._mmap.close()
+
+
+def _is_fresh(cache_file: Path, corpus_dir: Path) -> bool:
+    """
+    Checks whether the cache is up-to-date with the corpus. If files have
+    been touched, but their contents are the same (e.g. after a ``git
+    checkout``), their new modification times and sizes are recorded, so they
+    are not hashed again on the next load.
+    """
+    try:
+        with open(cache_file, 'rb') as inf:
+            if inf.read(len(MAGIC)) != MAGIC:
+                return False
+            header_len = int.from_bytes(inf.read(8), 'little')
+            header = json.loads(inf.read(header_len))
+    except (OSError, ValueError):
+        return False
+    if header.get('version') != FORMAT_VERSION or header.get('byteorder') != sys.byteorder:
+        return False
+
+    sources = header['sources']
+    files = corpus_files(corpus_dir)
+    if [str(f.relative_to(corpus_dir)) for f in files] != [s['file'] for s in sources]:
+        return False
+    touched = False
+    for file, source in zip(files, sources):
+        stat = file.stat()
+        if stat.st_mtime_ns == source['mtime_ns'] and stat.st_size == source['size']:
+            continue
+        # The file has been touched, but its contents might be the same
+        if file_hash(file) != source['sha1']:
+            return False
+        source['mtime_ns'], source['size'] = stat.st_mtime_ns, stat.st_size
+        touched = True
+    if touched:
+        return _rewrite_header(cache_file, header, header_len)
+    return True
+
+
+def _rewrite_header(cache_file: Path, header: dict, header_len: int) -> bool:
+    """
+    Replaces the header of the cache (atomically, via a temporary file). The
+    columns are copied as they are, so the new header must fit into the
+    padded space of the old one. Returns False if it does not, so the cache
+    has to be rebuilt.
+    """
+    header_bytes = json.dumps(header).encode('utf-8')
+    if len(header_bytes) > header_len:
+        return False
+    cache_file = Path(cache_file)
+    try:
+        with open(cache_file, 'rb') as inf, atomic_write(cache_file) as outf:
+            outf.write(MAGIC)
+            outf.write(header_len.to_bytes(8, 'little'))
+            outf.write(header_bytes.ljust(header_len))
+            inf.seek(len(MAGIC) + 8 + header_len)
+            shutil.copyfileobj(inf, outf)
+    except OSError:
+        # E.g. a read-only directory: the cache is still valid, only the
+        # touched files will be hashed again next time
+        pass
+    return True
+
+
+def build_cache(corpus_dir: Path, cache_file: Path):
+    """Compiles the XML files in _corpus_dir_ into _cache_file_."""
+    corpus_dir = Path(corpus_dir)
+    tables = {name: {} for name in STRING_TABLES}
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+    join_codes = {join: code for code, join in enumerate(JOIN_VALUES)}
+
+    def intern(table, s):
+        return tables[table].setdefault(s, len(tables[table]))
+
+    sources = []
+    for file in corpus_files(corpus_dir):
+        stat = file.stat()
+        rel_file = str(file.relative_to(corpus_dir))
+        sources.append({'file': rel_file, 'mtime_ns': stat.st_mtime_ns,
+                        'size': stat.st_size, 'sha1': file_hash(file)})
+        intern('files', rel_file)
+        columns['file_offsets'].append(len(columns['paragraph_id']))
+        for paragraph in read_tei(file):
+            columns['paragraph_offsets'].append(len(columns['sentence_id']))
+            columns['paragraph_id'].append(intern('ids', paragraph.id))
+            for sentence in paragraph.sentences:
+                columns['sentence_offsets'].append(len(columns['token_form']))
+                columns['sentence_id'].append(intern('ids', sentence.id))
+                for token in sentence.tokens:
+                    columns['token_form'].append(intern('forms', token.form))
+                    columns['token_id'].append(intern('ids', token.id))
+                    columns['token_join'].append(join_codes.get(token.join, NO_JOIN))
+                    ana = token.correct
+                    if ana is not None:
+                        columns['token_lemma'].append(intern('lemmas', ana.lemma))
+                        columns['token_simple'].append(intern('simple', ana.simple))
+                        columns['token_detailed'].append(intern('detailed', ana.detailed))
+                    else:
+                        for name in ('token_lemma', 'token_simple', 'token_detailed'):
+                            columns[name].append(MISSING)
+    # Closing offsets
+    columns['sentence_offsets'].append(len(columns['token_form']))
+    columns['paragraph_offsets'].append(len(columns['sentence_id']))
+    columns['file_offsets'].append(len(columns['paragraph_id']))
+
+    for field, table in INDEXED_FIELDS.items():
+        offsets, postings = _invert(columns[f'token_{field}'], len(tables[table]))
+        columns[f'{field}_posting_offsets'] = offsets
+        columns[f'{field}_postings'] = postings
+
+    for name, table in tables.items():
+        blob, offsets = bytearray(), array('q', [0])
+        for s in table:  # dicts keep the insertion (= index) order
+            blob.extend((s or '').encode('utf-8'))
+            offsets.append(len(blob))
+        columns[f'{name}_blob'] = array('B', blob)
+        columns[f'{name}_offsets'] = offsets
+
+    _write_cache(cache_file, sources, columns)
+
+
+def _invert(column: array, num_values: int) -> tuple[array, array]:
+    """
+    Inverts a token column with a counting sort: returns the offsets of the
+    postings of each value and the token indices ordered by value.
+    """
+    offsets = array('i', bytes(4 * (num_values + 1)))
+    for value in column:
+        if value != MISSING:
+            offsets[value + 1] += 1
+    for i in range(num_values):
+        offsets[i + 1] += offsets[i]
+    postings = array('i', bytes(4 * offsets[-1]))
+    next_free = array('i', offsets)
+    for token_idx, value in enumerate(column):
+        if value != MISSING:
+            postings[next_free[value]] = token_idx
+            next_free[value] += 1
+    return offsets, postings
+
+
+def _write_cache(cache_file: Path, sources: list[dict], columns: dict[str, array]):
+    """Writes the cache atomically (via a temporary file)."""
+    def align(n):
+        return (n + 7) & ~7
+
+    header = {'version': FORMAT_VERSION, 'byteorder': sys.byteorder,
+              'sources': sources, 'columns': {}}
+    # The offsets depend on the length of the header, which depends on the
+    # offsets: the header is padded to an estimated size, which is increased
+    # until the header fits. The padding also leaves room for the updates of
+    # _rewrite_header.
+    header_len = align(len(json.dumps(header)) + 64 * len(columns) + 1024)
+    while True:
+        offset = align(len(MAGIC) + 8 + header_len)
+        for name, column in columns.items():
+            length = len(column) * column.itemsize
+            header['columns'][name] = (offset, length, column.typecode)
+            offset = align(offset + length)
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) <= header_len:
+            break
+        header_len = align(len(header_bytes) + 1024)
+    header_bytes = header_bytes.ljust(header_len)
+
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(cache_file) as outf:
+        outf.write(MAGIC)
+        outf.write(len(header_bytes).to_bytes(8, 'little'))
+        outf.write(header_bytes)
+        for name, column in columns.items():
+            offset, _, _ = header['columns'][name]
+            outf.write(b'\0' * (offset - outf.tell()))
+            column.tofile(outf)
+
+
+def load_cache(corpus_dir: Path, cache_file: Path | None = None) -> CorpusCache:
+    """
+    Loads the cache of the corpus in _corpus_dir_, (re)building it first if it
+    does not exist or is out of date.
+
+    :param cache_file: the cache file; ``corpus.bin`` in :func:`cache_dir` by
+                       default.
+    """
+    corpus_dir = Path(corpus_dir)
+    if cache_file is None:
+        cache_file = cache_dir(corpus_dir) / 'corpus.bin'
+    if not _is_fresh(cache_file, corpus_dir):
+        build_cache(corpus_dir, cache_file)
+    return CorpusCache(cache_file)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Progress manifests for resumable conversions.
+
+The manifest is a JSON lines file with one record per checkpoint; the last
+record of an input file is its current state. Records are appended with a
+single write, so the worker processes of a conversion can share the
+manifest. It is compacted (rewritten with only the current records) when
+loaded.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from gold_standard.utils import atomic_write
+
+
+class Progress(NamedTuple):
+    """The state of the conversion of an input file."""
+    # The key of the input file (e.g. its path relative to the input directory)
+    input: str
+    # The SHA-1 hash of the input file
+    sha1: str
+    # The settings the output depends on (e.g. the model)
+    settings: dict[str, Any]
+    # The number of sentences written
+    sentences: int
+    # The size of the output up to the last sentence written
+    bytes: int
+    done: bool
+
+
+class Manifest:
+    """The progress manifest of a conversion."""
+    def __init__(self, manifest_file: Path, restart: bool = False):
+        """
+        :param restart: forget the progress of the previous runs.
+        """
+        self.manifest_file = Path(manifest_file)
+        self.records = {} if restart else self._load()
+        self._compact()
+
+    def _load(self) -> dict[str, Progress]:
+        records = {}
+        try:
+            with open(self.manifest_file, encoding='utf-8') as inf:
+                for line in inf:
+                    try:
+                        progress = Progress(**json.loads(line))
+                    except (ValueError, TypeError):
+                        # E.g. a partially written last line
+                        continue
+                    records[progress.input] = progress
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _compact(self):
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.manifest_file, 'wt', encoding='utf-8') as outf:
+            for progress in self.records.values():
+                outf.write(json.dumps(progress._asdict(), ensure_ascii=False) + '\n')
+
+    def get(self, key: str, sha1: str, settings: dict[str, Any]) -> Progress | None:
+        """
+        The progress of the input file _key_, if it was converted (at least
+        partially) from the same contents and with the same settings.
+        """
+        progress = self.records.get(key)
+        if progress is not None and progress.sha1 == sha1 and progress.settings == settings:
+            return progress
+        return None
+
+    def record(self, progress: Progress):
+        """Appends a checkpoint to the manifest."""
+        self.records[progress.input] = progress
+        line = json.dumps(progress._asdict(), ensure_ascii=False) + '\n'
+        # A single write in append mode, so that the lines of the processes
+        # are not interleaved
+        fd = os.open(self.manifest_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
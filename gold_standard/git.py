@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Helpers to find the corpus files changed in a git working tree, so that the
+QA scripts can check only those.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+import subprocess
+
+
+def blob_hash(file: Path) -> str:
+    """
+    The SHA-1 hash git gives the contents of _file_ (``git hash-object``),
+    computed without git. For a file unchanged since it was checked out,
+    it is the blob id in the repository.
+    """
+    h = hashlib.sha1(b'blob %d\0' % os.path.getsize(file))
+    with open(file, 'rb') as inf:
+        while chunk := inf.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _git(cwd: Path, *args: str) -> list[str]:
+    """Runs git in _cwd_ and returns the NUL separated items of its output."""
+    try:
+        result = subprocess.run(['git', '-C', str(cwd), *args], capture_output=True)
+    except FileNotFoundError:
+        raise RuntimeError('git is not installed') from None
+    if result.returncode != 0:
+        raise RuntimeError(f'git {args[0]} failed: '
+                           f'{result.stderr.decode("utf-8", "replace").strip()}')
+    return [os.fsdecode(item) for item in result.stdout.split(b'\0') if item]
+
+
+def repository_root(path: Path) -> Path:
+    """The top level directory of the git working tree _path_ is in."""
+    path = Path(path).resolve()
+    directory = path if path.is_dir() else path.parent
+    return Path(_git(directory, 'rev-parse', '--show-toplevel')[0].rstrip('\n'))
+
+
+def changed_files(paths: list[Path], ref: str = 'HEAD') -> set[Path]:
+    """
+    The files under _paths_ that differ from _ref_ in the working tree
+    (staged or not) or are untracked (and not ignored). Deleted files are
+    not included. The paths returned are resolved.
+
+    :raise RuntimeError: if git fails (e.g. _paths_ is not in a working tree
+                         or _ref_ does not exist).
+    """
+    paths = [Path(path).resolve() for path in paths]
+    root = repository_root(paths[0])
+    pathspecs = [str(path) for path in paths]
+    names = _git(root, 'diff', '--name-only', '-z', '--no-renames', ref, '--', *pathspecs)
+    names += _git(root, 'ls-files', '-z', '--others', '--exclude-standard', '--', *pathspecs)
+    files = {(root / name).resolve() for name in names}
+    return {file for file in files if file.is_file()}
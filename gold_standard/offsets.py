@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Random access to the elements of a TEI XML file by xml:id.
+
+A sidecar index maps every xml:id in the file to the byte range of its
+element. It is built in a single streaming pass with expat and stored as an
+open addressing hash table, so a lookup reads a few bytes of the index and
+then only the fragment of the XML file that contains the element.
+
+The index is stored as ``.cache/{name}.offsets`` next to the XML file and is
+rebuilt automatically if the XML file changes.
+"""
+
+from array import array
+import json
+import mmap
+from pathlib import Path
+import shutil
+from xml.parsers import expat
+import zlib
+
+from gold_standard.backend import fromstring
+from gold_standard.cache import file_hash
+from gold_standard.tei import Sentence, Token, sentence_from_element, token_from_element
+from gold_standard.utils import atomic_write
+
+
+MAGIC = b'GSOFFS01'
+# The number of int64s per hash table slot: start, end, id offset, id length
+SLOT_SIZE = 4
+# The value of start in empty slots
+EMPTY = -1
+
+
+def index_file_for(xml_file: Path) -> Path:
+    """The default location of the index of _xml_file_."""
+    xml_file = Path(xml_file)
+    return xml_file.parent / '.cache' / f'{xml_file.name}.offsets'
+
+
+def _scan(xml_file: Path, chunk_size: int = 1 << 20) -> list[tuple[str, int, int]]:
+    """
+    Returns the (xml:id, start, end) byte ranges of all elements that have
+    an xml:id, in document order of their start tags.
+    """
+    ranges = []
+    # Per open element: its index in ranges (or None) and start offset
+    stack = []
+    # Whether nothing has been seen since the last start tag (which is then
+    # either empty or self-closing)
+    just_started = False
+    # The end of the data read so far, with the offset of its first byte;
+    # kept long enough to find the > of end tags
+    window, window_start = b'', 0
+
+    def start(name, attrs):
+        nonlocal just_started
+        pos = parser.CurrentByteIndex
+        xml_id = attrs.get('xml:id')
+        if xml_id is not None:
+            stack.append(len(ranges))
+            ranges.append([xml_id, pos, None])
+        else:
+            stack.append(None)
+        just_started = True
+
+    def end(name):
+        nonlocal just_started
+        range_idx = stack.pop()
+        if range_idx is not None:
+            pos = parser.CurrentByteIndex
+            rel_pos = pos - window_start
+            if just_started and window[rel_pos - 2:rel_pos] == b'/>':
+                # Self-closing: the position is already after the tag
+                ranges[range_idx][2] = pos
+            else:
+                ranges[range_idx][2] = window.index(b'>', rel_pos) + window_start + 1
+        just_started = False
+
+    def content(_):
+        nonlocal just_started
+        just_started = False
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = content
+    parser.CommentHandler = content
+    parser.ProcessingInstructionHandler = lambda *_: content(None)
+    with open(xml_file, 'rb') as inf:
+        while chunk := inf.read(chunk_size):
+            # Keep the tail of the previous chunk for tags that span chunks
+            tail = window[-4096:]
+            window_start += len(window) - len(tail)
+            window = tail + chunk
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+    return [tuple(r) for r in ranges]
+
+
+def build_offset_index(xml_file: Path, index_file: Path | None = None):
+    """Builds the offset index of _xml_file_ (see :func:`index_file_for`)."""
+    xml_file = Path(xml_file)
+    index_file = Path(index_file or index_file_for(xml_file))
+    ranges = _scan(xml_file)
+
+    num_slots = 1
+    while num_slots < 2 * len(ranges):
+        num_slots *= 2
+    table = array('q', [EMPTY, 0, 0, 0]) * num_slots
+    blob = bytearray()
+    for xml_id, start, end in ranges:
+        key = xml_id.encode('utf-8')
+        slot = zlib.crc32(key) & (num_slots - 1)
+        while table[slot * SLOT_SIZE] != EMPTY:
+            slot = (slot + 1) & (num_slots - 1)
+        # Duplicate ids: the first one wins, as lookups find it first
+        table[slot * SLOT_SIZE:(slot + 1) * SLOT_SIZE] = array(
+            'q', [start, end, len(blob), len(key)])
+        blob.extend(key)
+
+    stat = xml_file.stat()
+    header = json.dumps({'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                         'sha1': file_hash(xml_file), 'num_ids': len(ranges),
+                         'num_slots': num_slots}).encode('utf-8')
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(index_file) as outf:
+        outf.write(MAGIC)
+        outf.write(len(header).to_bytes(8, 'little'))
+        outf.write(header)
+        outf.write(b'\0' * (-outf.tell() % 8))
+        table.tofile(outf)
+        outf.write(blob)
+
+
+class OffsetIndex:
+    """The offset index of a TEI XML file."""
+    def __init__(self, xml_file: Path, index_file: Path | None = None):
+        self.xml_file = Path(xml_file)
+        self.index_file = Path(index_file or index_file_for(self.xml_file))
+        if not self._is_fresh():
+            build_offset_index(self.xml_file, self.index_file)
+
+        with open(self.index_file, 'rb') as inf:
+            self._mmap = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        header_len = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], 'little')
+        table_start = len(MAGIC) + 8 + header_len
+        self.header = json.loads(str(buffer[len(MAGIC) + 8:table_start], 'utf-8'))
+        table_start += -table_start % 8
+        self._num_slots = self.header['num_slots']
+        table_end = table_start + self._num_slots * SLOT_SIZE * 8
+        self._table = buffer[table_start:table_end].cast('q')
+        self._blob = buffer[table_end:]
+
+    def _is_fresh(self) -> bool:
+        """
+        Checks whether the index is up-to-date with the XML file. If the file
+        has been touched, but its contents are the same, its new modification
+        time and size are recorded, so it is not hashed again next time.
+        """
+        try:
+            with open(self.index_file, 'rb') as inf:
+                if inf.read(len(MAGIC)) != MAGIC:
+                    return False
+                header_len = int.from_bytes(inf.read(8), 'little')
+                header = json.loads(inf.read(header_len))
+            stat = self.xml_file.stat()
+        except (OSError, ValueError):
+            return False
+        if stat.st_mtime_ns == header['mtime_ns'] and stat.st_size == header['size']:
+            return True
+        if file_hash(self.xml_file) != header['sha1']:
+            return False
+        header['mtime_ns'], header['size'] = stat.st_mtime_ns, stat.st_size
+        self._rewrite_header(header, header_len)
+        return True
+
+    def _rewrite_header(self, header: dict, old_header_len: int):
+        """
+        Replaces the header of the index (atomically); the hash table and the
+        ids are copied as they are, as they do not depend on the header.
+        """
+        table_start = len(MAGIC) + 8 + old_header_len
+        table_start += -table_start % 8
+        header_bytes = json.dumps(header).encode('utf-8')
+        try:
+            with open(self.index_file, 'rb') as inf, atomic_write(self.index_file) as outf:
+                outf.write(MAGIC)
+                outf.write(len(header_bytes).to_bytes(8, 'little'))
+                outf.write(header_bytes)
+                outf.write(b'\0' * (-outf.tell() % 8))
+                inf.seek(table_start)
+                shutil.copyfileobj(inf, outf)
+        except OSError:
+            # E.g. a read-only directory: the index is still valid, the file
+            # will only be hashed again next time
+            pass
+
+    def __len__(self):
+        return self.header['num_ids']
+
+    def __contains__(self, xml_id: str) -> bool:
+        return self.range(xml_id) is not None
+
+    def range(self, xml_id: str) -> tuple[int, int] | None:
+        """The (start, end) byte range of the element with _xml_id_."""
+        key = xml_id.encode('utf-8')
+        mask = self._num_slots - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            start, end, id_offset, id_len = self._table[slot * SLOT_SIZE:(slot + 1) * SLOT_SIZE]
+            if start == EMPTY:
+                return None
+            if id_len == len(key) and self._blob[id_offset:id_offset + id_len] == key:
+                return start, end
+            slot = (slot + 1) & mask
+
+    def fragment(self, xml_id: str) -> bytes:
+        """The XML source of the element with _xml_id_."""
+        byte_range = self.range(xml_id)
+        if byte_range is None:
+            raise KeyError(xml_id)
+        start, end = byte_range
+        with open(self.xml_file, 'rb') as inf:
+            inf.seek(start)
+            return inf.read(end - start)
+
+    def element(self, xml_id: str):
+        """The element with _xml_id_, parsed from its fragment."""
+        return fromstring(self.fragment(xml_id))
+
+    def sentence(self, xml_id: str) -> Sentence:
+        """The <s> with _xml_id_ as a record."""
+        return sentence_from_element(self.element(xml_id))
+
+    def token(self, xml_id: str) -> Token:
+        """The <token> with _xml_id_ as a record."""
+        return token_from_element(self.element(xml_id))
+
+    def close(self):
+        self._table.release()
+        self._blob.release()
+        self._mmap.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Concordance search over the gold standard, based on the inverted index in
+the corpus cache (see :mod:`gold_standard.cache`).
+"""
+
+from bisect import bisect_right
+from collections.abc import Iterable, Iterator
+import re
+from typing import NamedTuple
+
+from gold_standard.cache import INDEXED_FIELDS, CorpusCache, MISSING
+from gold_standard.tei import JOIN_VALUES, spaces_from_joins
+
+
+class Hit(NamedTuple):
+    """A match with its context."""
+    file: str
+    sentence_id: str
+    token_id: str
+    left: str
+    keyword: str
+    right: str
+
+
+def _value_indices(cache: CorpusCache, field: str, value: str,
+                   regex: bool) -> set[int]:
+    """The indices of the strings of _field_ that match _value_."""
+    table = getattr(cache, INDEXED_FIELDS[field])
+    if not regex:
+        value_idx = table.index(value)
+        return set() if value_idx == MISSING else {value_idx}
+    pattern = re.compile(value)
+    return {i for i, s in enumerate(table) if pattern.fullmatch(s)}
+
+
+def search(cache: CorpusCache, constraints: dict[str, str],
+           genres: Iterable[str] | None = None,
+           regex: bool = False) -> Iterator[int]:
+    """
+    Finds the tokens that satisfy all _constraints_.
+
+    :param constraints: field (see :data:`INDEXED_FIELDS`) -> value.
+    :param genres: only search in these genres (subdirectories).
+    :param regex: the values are regular expressions that must match the
+                  whole string.
+    :return: the indices of the matching tokens in corpus order.
+    """
+    if not constraints:
+        raise ValueError('At least one constraint is required')
+    matching = {field: _value_indices(cache, field, value, regex)
+                for field, value in constraints.items()}
+
+    # The candidates come from the postings of the most selective field; the
+    # others are checked against the token columns
+    def num_postings(field):
+        return sum(len(cache.postings(field, i)) for i in matching[field])
+
+    first, *rest = sorted(matching, key=num_postings)
+    if len(matching[first]) == 1:
+        candidates = cache.postings(first, next(iter(matching[first])))
+    else:
+        candidates = sorted(token_idx for value_idx in matching[first]
+                            for token_idx in cache.postings(first, value_idx))
+    checks = [(getattr(cache, f'token_{field}'), matching[field])
+              for field in rest]
+
+    if genres is not None:
+        # The first token of each file and whether the file is selected; a
+        # candidate's file is found by bisection
+        genres = set(genres)
+        file_starts = [cache.file_tokens(file_idx).start
+                       for file_idx in range(cache.num_files)]
+        selected = [cache.genre(file_idx) in genres
+                    for file_idx in range(cache.num_files)]
+    else:
+        file_starts = selected = None
+
+    for token_idx in candidates:
+        if all(column[token_idx] in values for column, values in checks):
+            if (selected is None
+                    or selected[bisect_right(file_starts, token_idx) - 1]):
+                yield token_idx
+
+
+def detokenize(cache: CorpusCache, tokens: range) -> str:
+    """
+    Rebuilds the text of consecutive tokens. Whitespace is put between two
+    tokens unless the first joins to the right or the second to the left.
+    """
+    joins = [cache.token_join[token_idx] for token_idx in tokens]
+    joins = [JOIN_VALUES[code] if code < len(JOIN_VALUES) else None
+             for code in joins]
+    spaces = spaces_from_joins(joins)
+    pieces = []
+    for token_idx, space in zip(tokens, spaces):
+        pieces.append(cache.forms[cache.token_form[token_idx]])
+        pieces.append(' ' if space else '')
+    return ''.join(pieces[:-1])
+
+
+def kwic(cache: CorpusCache, token_idx: int, width: int = 40) -> Hit:
+    """
+    The keyword in context view of a token: the text of its sentence before
+    and after the token, truncated to _width_ characters.
+    """
+    sent_idx = cache.token_sentence(token_idx)
+    sent_tokens = cache.sentence_tokens(sent_idx)
+    left = detokenize(cache, range(sent_tokens.start, token_idx))
+    right = detokenize(cache, range(token_idx + 1, sent_tokens.stop))
+    return Hit(cache.files[cache.sentence_file(sent_idx)],
+               cache.ids[cache.sentence_id[sent_idx]],
+               cache.ids[cache.token_id[token_idx]],
+               left[-width:], cache.forms[cache.token_form[token_idx]],
+               right[:width])
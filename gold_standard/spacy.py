@@ -3,13 +3,152 @@
 
 """spaCy-related stuff."""
 
+from collections.abc import Iterator, Sequence
+import re
+
+from spacy.attrs import DEP, HEAD, LEMMA, MORPH, POS, SPACY, TAG
+from spacy.language import Language
 from spacy.tokens import Doc
+from spacy.vocab import Vocab
+
+from gold_standard.tei import Sentence, Token, spaces_from_joins
+
+
+CONLLU_FIELDS = ('ID', 'FORM', 'LEMMA', 'UPOS', 'XPOS', 'FEATS', 'HEAD',
+                 'DEPREL', 'DEPS', 'MISC')
+
+# The factories of the components that (re)compute what gold_doc() takes from
+# the gold standard, or that we do not output at all. The hu.* ones are the
+# lemmatizer components of huspaCy.
+GOLD_DISABLED_FACTORIES = {
+    'tagger', 'morphologizer', 'lemmatizer', 'trainable_lemmatizer',
+    'attribute_ruler', 'ner', 'entity_ruler',
+    'hu.lookup_lemmatizer', 'hu.lemma_smoother',
+}
+
+
+# The main categories of emMorph (the tag after the slash, without the
+# |subcategories) -> UPOS. emMorph does not tell coordinating and
+# subordinating conjunctions, proper and common nouns or auxiliaries and
+# verbs apart; they all get the first one.
+EMMORPH_UPOS = {
+    'N': 'NOUN', 'Adj': 'ADJ', 'Adv': 'ADV', 'V': 'VERB', 'Num': 'NUM',
+    'Det': 'DET', 'Cnj': 'CCONJ', 'Post': 'ADP', 'Prep': 'ADP',
+    'Prev': 'ADV', 'Inj-Utt': 'INTJ', 'QPtcl': 'PART', 'Punct': 'PUNCT',
+    'Hyph:Dash': 'PUNCT', 'X': 'X',
+}
+# emMorph case tags -> the values of the UD Case feature
+EMMORPH_CASES = {
+    'Nom': 'Nom', 'Acc': 'Acc', 'Dat': 'Dat', 'Ins': 'Ins', 'Ine': 'Ine',
+    'Ill': 'Ill', 'Ela': 'Ela', 'Supe': 'Sup', 'Subl': 'Sub', 'Del': 'Del',
+    'Ade': 'Ade', 'All': 'All', 'Abl': 'Abl', 'Ter': 'Ter', 'Transl': 'Tra',
+    'Ess': 'Ess', 'EssFor': 'Frm', 'Cau': 'Cau', 'Temp': 'Tem', 'Loc': 'Loc',
+}
+# Derivational tags (without the _ and the category) -> UD features
+EMMORPH_DERIVATIONS = {
+    'Comp': {'Degree': 'Cmp'}, 'Ord': {'NumType': 'Ord'},
+    'Frac': {'NumType': 'Frac'}, 'ImpfPtcp': {'VerbForm': 'Part'},
+    'PerfPtcp': {'VerbForm': 'Part'}, 'FutPtcp': {'VerbForm': 'Part'},
+    'ModPtcp': {'VerbForm': 'Part'}, 'AdvPtcp': {'VerbForm': 'Conv'},
+    'AdvPerfPtcp': {'VerbForm': 'Conv'},
+}
+EMMORPH_MOODS = {'Prs': ('Ind', 'Pres'), 'Pst': ('Ind', 'Past'),
+                 'Cond': ('Cnd', 'Pres'), 'Sbjv': ('Imp', 'Pres')}
+EMMORPH_NUMBERS = {'Sg': 'Sing', 'Pl': 'Plur'}
+
+_EMMORPH_TAG = re.compile(r'\[([^][]*)\]')
+_EMMORPH_VERB = re.compile(r'(Prs|Pst|Cond|Sbjv)\.(?:(N?Def)\.)?([123])(Sg|Pl)(›2)?')
+_EMMORPH_PERSON = re.compile(r'(Pl\.)?(Poss|Inf)\.([123])(Sg|Pl)')
+
+
+def ud_from_emmorph(simple: str) -> tuple[str, str]:
+    """
+    Converts the simple emMorph tag of an analysis (e.g.
+    ``[/N][Poss.3Sg][Acc]``) to UPOS and UD features (FEATS). The category
+    is that of the last derivation, if any. Only the frequent inflections
+    and derivations are converted and tags that are not understood are
+    skipped, so the result is an approximation of the UD annotation.
+
+    :return: the UPOS and the features in CoNLL-U format; an empty UPOS
+             if the category is unknown.
+    """
+    upos, feats, superlative = '', {}, False
+    for tag in _EMMORPH_TAG.findall(simple):
+        derivation, _, category = tag.rpartition('/')
+        if derivation.startswith('_'):
+            feats.update(EMMORPH_DERIVATIONS.get(
+                derivation[1:].partition(':')[0], {}))
+        elif derivation or tag.startswith('/'):
+            if category == 'Supl':
+                superlative = True
+                continue
+            # A new stem (e.g. in a compound) restarts the features
+            feats = {}
+        main, *subcategories = category.split('|')
+        if main in EMMORPH_UPOS:
+            upos = EMMORPH_UPOS[main]
+            if 'Pro' in subcategories:
+                if upos in ('NOUN', 'ADJ', 'NUM'):
+                    upos = 'PRON'
+                if 'Int' in subcategories:
+                    feats['PronType'] = 'Int'
+                elif 'Rel' in subcategories:
+                    feats['PronType'] = 'Rel'
+            if 'Abbr' in subcategories:
+                feats['Abbr'] = 'Yes'
+            if 'Art.Def' in subcategories:
+                feats.update(PronType='Art', Definite='Def')
+            elif 'Art.NDef' in subcategories:
+                feats.update(PronType='Art', Definite='Ind')
+            continue
+        case = EMMORPH_CASES.get(tag.partition(':')[0])
+        if case is not None:
+            feats['Case'] = case
+            feats.setdefault('Number', 'Sing')
+        elif tag == 'Pl':
+            feats['Number'] = 'Plur'
+        elif m := _EMMORPH_VERB.fullmatch(tag.rstrip('*')):
+            mood, definite, person, number, object_2 = m.groups()
+            feats['Mood'], feats['Tense'] = EMMORPH_MOODS[mood]
+            if object_2 is not None:
+                feats['Definite'] = '2'
+            elif definite is not None:
+                feats['Definite'] = 'Def' if definite == 'Def' else 'Ind'
+            feats.update(Number=EMMORPH_NUMBERS[number], Person=person,
+                         VerbForm='Fin')
+        elif m := _EMMORPH_PERSON.fullmatch(tag.rstrip('*')):
+            plural, kind, person, number = m.groups()
+            if kind == 'Inf':
+                feats.update(Number=EMMORPH_NUMBERS[number], Person=person,
+                             VerbForm='Inf')
+            else:
+                feats.update({'Number[psor]': EMMORPH_NUMBERS[number],
+                              'Person[psor]': person})
+                if plural:
+                    feats['Number'] = 'Plur'
+        elif tag == 'Inf':
+            feats['VerbForm'] = 'Inf'
+    # The superlative is leg- + the comparative
+    if superlative and feats.get('Degree') == 'Cmp':
+        feats['Degree'] = 'Sup'
+    return upos, '|'.join(f'{name}={value}' for name, value
+                          in sorted(feats.items(), key=lambda f: f[0].lower()))
+
+
+def _words_and_spaces(tokens: Sequence[Token]) -> tuple[list[str], list[bool]]:
+    """The words and spaces arguments of :class:`Doc` for _tokens_."""
+    # Avoid zero-length tokens, which spaCy does not allow
+    return ([token.form or ' ' for token in tokens],
+            spaces_from_joins([token.join for token in tokens]))
 
 
 class WhitespaceTokenizer:
     """
     A tokenizer that splits on whitespaces. Required if we want to run spaCy
     on already tokenized data.
+
+    The tokens read from the TEI files should be converted with
+    :meth:`from_tokens` instead, which also keeps the original spacing.
     """
     def __init__(self, vocab):
         self.vocab = vocab
@@ -30,3 +169,85 @@ class WhitespaceTokenizer:
             spaces[-1] = False
 
         return Doc(self.vocab, words=words, spaces=spaces)
+
+    def from_tokens(self, tokens: Sequence[Token]) -> Doc:
+        """
+        Creates a Doc from already split _tokens_ (e.g. those of a
+        :class:`Sentence`) without joining and splitting them again, so forms
+        that contain a space (e.g. 91 000) remain single tokens. The
+        whitespace after the tokens comes from their join attributes (see
+        :func:`spaces_from_joins`).
+        """
+        words, spaces = _words_and_spaces(tokens)
+        return Doc(self.vocab, words=words, spaces=spaces)
+
+
+def gold_doc(vocab: Vocab, sentence: Sentence) -> Doc:
+    """
+    Creates a Doc from _sentence_ with the gold standard annotation already
+    set: the lemma and the tag (XPOS) come from the correct analysis (the
+    simple emMorph tag), and the UPOS and the features are converted from
+    the tag with :func:`ud_from_emmorph`. Tokens without a correct analysis
+    get none of them. The tokens and the whitespace are the same as with
+    :meth:`WhitespaceTokenizer.from_tokens`.
+    """
+    words, spaces = _words_and_spaces(sentence.tokens)
+    lemmas, tags, pos, morphs = [], [], [], []
+    for token in sentence.tokens:
+        ana = token.correct
+        lemmas.append(ana.lemma if ana is not None else '')
+        tags.append(ana.simple if ana is not None else '')
+        upos, feats = ud_from_emmorph(tags[-1])
+        pos.append(upos)
+        morphs.append(feats)
+    return Doc(vocab, words=words, spaces=spaces, lemmas=lemmas, tags=tags,
+               pos=pos, morphs=morphs)
+
+
+def disable_taggers(nlp: Language) -> list[str]:
+    """
+    Disables the components of _nlp_ that would overwrite the annotation set
+    by :func:`gold_doc`, so that only the dependency parser (and the shared
+    embedding layers) run. See :data:`GOLD_DISABLED_FACTORIES`.
+
+    :return: the names of the disabled components.
+    """
+    disabled = [name for name in nlp.pipe_names
+                if nlp.get_pipe_meta(name).factory in GOLD_DISABLED_FACTORIES]
+    for name in disabled:
+        nlp.disable_pipe(name)
+    return disabled
+
+
+def conllu_lines(doc: Doc, ids: Sequence[str] | None = None) -> Iterator[str]:
+    """
+    Converts _doc_ to CoNLL-U lines (without the trailing empty line). The
+    whole Doc is treated as one sentence, even if spaCy split it: the HEAD
+    column refers to positions in the Doc.
+
+    The annotations are read with a single :meth:`Doc.to_array` call instead
+    of through the :class:`Token` objects.
+
+    :param ids: the values of the ID column; 1, 2, ... by default.
+    """
+    strings = doc.vocab.strings
+    # Label hash -> string, or _ if empty
+    labels = {}
+
+    def label(key):
+        key = int(key)
+        if key not in labels:
+            labels[key] = strings[key] or '_'
+        return labels[key]
+
+    array = doc.to_array([HEAD, LEMMA, POS, TAG, MORPH, DEP, SPACY])
+    # Head offsets are stored as unsigned integers
+    heads = array[:, 0].astype('int64')
+    for i, (form, head, (_, lemma, pos, tag, morph, dep, space)) in enumerate(
+            zip((token.text for token in doc), heads, array)):
+        dep_label = label(dep)
+        head_idx = 0 if dep_label.lower() == 'root' else i + head + 1
+        yield '\t'.join((ids[i] if ids is not None else str(i + 1), form,
+                         label(lemma), label(pos), label(tag), label(morph),
+                         str(head_idx), dep_label, '_',
+                         '_' if space else 'SpaceAfter=No'))
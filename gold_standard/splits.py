@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Deterministic train / dev / test splits of the corpus.
+
+The splits are stratified by genre (the subdirectory of a file) and keyed by
+document, so that the annotations of the same text by different annotators
+(e.g. ``cult003_annot1.xml`` and ``cult003_annot2.xml``) always end up in the
+same split. The assignment depends only on the document ids, the ratios and
+the seed, not on the order or the number of the files.
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable, Sequence
+import hashlib
+from pathlib import Path
+
+
+SPLITS = ('train', 'dev', 'test')
+DEFAULT_RATIOS = (0.8, 0.1, 0.1)
+
+
+def document_id(xml_file: Path) -> str:
+    """The id of the document in _xml_file_, without the annotator suffix."""
+    return Path(xml_file).stem.rsplit('_', 1)[0]
+
+
+def genre(xml_file: Path) -> str:
+    """The genre (the name of the subdirectory) of _xml_file_."""
+    return Path(xml_file).parent.name
+
+
+def _shuffle_key(doc_id: str, seed: str) -> bytes:
+    return hashlib.sha1(f'{seed}/{doc_id}'.encode('utf-8')).digest()
+
+
+def assign_splits(xml_files: Iterable[Path],
+                  ratios: Sequence[float] = DEFAULT_RATIOS,
+                  seed: str = '') -> dict[Path, str]:
+    """
+    Assigns each file to one of :data:`SPLITS`.
+
+    In each genre, the documents are shuffled by a hash of their id and the
+    _seed_, and divided according to _ratios_ (rounded to whole documents,
+    so small genres might have no dev or test documents).
+
+    :param ratios: the relative sizes of the splits, in the order of
+                   :data:`SPLITS`.
+    :return: file -> split name.
+    """
+    if len(ratios) != len(SPLITS) or any(r < 0 for r in ratios) or sum(ratios) <= 0:
+        raise ValueError(f'Invalid split ratios: {ratios}')
+
+    # genre -> document id -> files
+    documents = defaultdict(lambda: defaultdict(list))
+    for xml_file in xml_files:
+        documents[genre(xml_file)][document_id(xml_file)].append(Path(xml_file))
+
+    total = sum(ratios)
+    splits = {}
+    for genre_docs in documents.values():
+        doc_ids = sorted(genre_docs, key=lambda doc_id: _shuffle_key(doc_id, seed))
+        cumulative = 0
+        boundaries = []
+        for ratio in ratios:
+            cumulative += ratio
+            boundaries.append(round(len(doc_ids) * cumulative / total))
+        split_idx = 0
+        for i, doc_id in enumerate(doc_ids):
+            while i >= boundaries[split_idx]:
+                split_idx += 1
+            for xml_file in genre_docs[doc_id]:
+                splits[xml_file] = SPLITS[split_idx]
+    return splits
@@ -3,35 +3,228 @@
 
 """Contains code to iterate through / edit TEI XML files."""
 
-from collections.abc import Generator
+from collections.abc import Generator, Sequence
+from dataclasses import dataclass, field
 from pathlib import Path
-from xml.etree import ElementTree
+from typing import NamedTuple
 
+from gold_standard.backend import XML_ID, discard, iterparse
 
-def sentences(tei_xml_file: Path) -> Generator[tuple[list[str], list[str]]]:
+# The values of the join attribute of <token>
+JOIN_VALUES = ('no', 'left', 'right', 'both')
+LEFT = {'left', 'both'}
+RIGHT = {'right', 'both'}
+
+
+class Analysis(NamedTuple):
+    """An <ana> element: one possible analysis of a token."""
+    lemma: str
+    detailed: str
+    simple: str
+    correct: bool
+    modified: bool
+
+
+@dataclass
+class Token:
+    """
+    A <token> element. Textual values are stripped; missing elements and
+    attributes are represented by empty strings and ``None``, respectively.
     """
-    Iterates through the sentences of a TEI XML file.
+    id: str | None
+    form: str
+    join: str | None
+    # The modified attribute of <form>
+    form_modified: bool
+    # The check attribute of <morph>; None if there is no <morph>
+    check: bool | None
+    analyses: list[Analysis]
+
+    @property
+    def correct(self) -> Analysis | None:
+        """The (first) analysis marked as correct, if any."""
+        for ana in self.analyses:
+            if ana.correct:
+                return ana
+        return None
 
-    :return: Yields a list of surface forms for each sentence.
+
+@dataclass
+class Sentence:
+    """An <s> element."""
+    id: str | None
+    modified: bool
+    tokens: list[Token] = field(default_factory=list)
+
+
+@dataclass
+class Paragraph:
+    """A <p> element in the <text>."""
+    id: str | None
+    sentences: list[Sentence] = field(default_factory=list)
+
+
+def spaces_from_joins(joins: Sequence[str | None]) -> list[bool]:
+    """
+    Whether each token is followed by whitespace, based on the join
+    attributes of the tokens: there is no space between two tokens if the
+    first joins to the right or the second to the left. The last token is
+    followed by a space unless it joins to the right.
     """
-    namespaces = {
-        '': 'http://www.tei-c.org/ns/1.0',
-        'xml': 'http://www.w3.org/XML/1998/namespace'
-    }
-    # TODO I am not sure this is needed at all
-    for prefix, uri in namespaces.items():
-        ElementTree.register_namespace(prefix, uri)
+    spaces = [join not in RIGHT for join in joins]
+    for i, join in enumerate(joins[1:]):
+        if join in LEFT:
+            spaces[i] = False
+    return spaces
 
-    with open(tei_xml_file, 'rt', encoding='utf-8') as inf:
-        xml_text = inf.read()
 
-    xml = ElementTree.fromstring(xml_text)
-    # TODO: is there a better way? To do this without a namespace?
-    id_attr = ElementTree.QName(namespaces['xml'], 'id')
-    for p_tag in xml.iterfind('.//text//p'):
-        for s_tag in p_tag.iterfind('.//s'):
-            tokens = [(t_tag.find('form').text.strip(), t_tag.get(id_attr))
-                      for t_tag in s_tag.iterfind('.//token')]
-            if tokens:
-                words, ids = zip(*tokens)
-                yield(' '.join(words), ids)
+# Creates an Analysis without the keyword argument handling of its __new__
+_new_analysis = tuple.__new__
+
+
+def token_from_element(t_tag) -> Token:
+    """
+    Converts a <token> element to a :class:`Token`. The subtree is walked
+    only once, which is much faster than ``find()`` calls (with lxml in
+    particular, as it has to create a proxy object for each element visited).
+    """
+    form = check = ana = None
+    lemma = detailed = simple = None
+    analyses = []
+    # Document order: an <ana> comes before its children. The tests are in
+    # the order of frequency; the texts are stripped inline (no function
+    # call per element)
+    for elem in t_tag.iter():
+        tag = elem.tag
+        if tag == 'ana':
+            if ana is not None:
+                analyses.append(_new_analysis(Analysis, (
+                    lemma or '', detailed or '', simple or '',
+                    ana.get('correct') == 'True', ana.get('modified') == 'True')))
+            ana = elem
+            lemma = detailed = simple = None
+        elif tag == 'lemma':
+            if lemma is None:
+                text = elem.text
+                lemma = text.strip() if text else ''
+        elif tag == 'detailed':
+            if detailed is None:
+                text = elem.text
+                detailed = text.strip() if text else ''
+        elif tag == 'simple':
+            if simple is None:
+                text = elem.text
+                simple = text.strip() if text else ''
+        elif tag == 'form':
+            if form is None:
+                form = elem
+        elif tag == 'morph':
+            if check is None:
+                check = elem.get('check') == 'True'
+    if ana is not None:
+        analyses.append(_new_analysis(Analysis, (
+            lemma or '', detailed or '', simple or '',
+            ana.get('correct') == 'True', ana.get('modified') == 'True')))
+    if form is None:
+        return Token(t_tag.get(XML_ID), '', t_tag.get('join'), False, check,
+                     analyses)
+    text = form.text
+    return Token(t_tag.get(XML_ID), text.strip() if text else '',
+                 t_tag.get('join'), form.get('modified') == 'True', check,
+                 analyses)
+
+
+def _add_tokens(elem, tokens: list[Token]):
+    """
+    Converts the <token>s under _elem_ that are not inside another <token>
+    (including those in nested <s>s) and adds them to _tokens_.
+    """
+    for child in elem:
+        if child.tag == 'token':
+            tokens.append(token_from_element(child))
+        else:
+            _add_tokens(child, tokens)
+
+
+def _add_sentences(elem, sentences: list[Sentence]):
+    """
+    Converts the <s>s under _elem_ that are not inside another <s> and adds
+    them to _sentences_.
+    """
+    for child in elem:
+        if child.tag == 's':
+            sentences.append(sentence_from_element(child))
+        else:
+            _add_sentences(child, sentences)
+
+
+def sentence_from_element(s_tag) -> Sentence:
+    """
+    Converts an <s> element to a :class:`Sentence`. The tokens of nested
+    <s>s (which should not exist) belong to the outermost one.
+    """
+    sentence = Sentence(s_tag.get(XML_ID), s_tag.get('modified') == 'True')
+    _add_tokens(s_tag, sentence.tokens)
+    return sentence
+
+
+def paragraph_from_element(p_tag) -> Paragraph:
+    """Converts a <p> element to a :class:`Paragraph`."""
+    paragraph = Paragraph(p_tag.get(XML_ID))
+    _add_sentences(p_tag, paragraph.sentences)
+    return paragraph
+
+
+def read_tei(tei_xml_file: Path) -> Generator[Paragraph]:
+    """
+    Reads the text of a TEI XML file in a single, incremental pass.
+
+    Only the paragraph being read is kept in memory: it is converted to
+    records when it has been parsed and then removed from the tree, so memory
+    usage does not depend on the size of the file. Only the start and end of
+    <text> and <p> are reported by the parser; the records are built by
+    walking the paragraph, which is much cheaper than an event per element.
+
+    :return: Yields the outermost <p> elements under <text> one by one.
+    """
+    # How many <text> tags enclose the current element
+    in_text = 0
+    p_elem = None
+    for event, elem in iterparse(tei_xml_file, events=('start', 'end'),
+                                 tag=('text', 'p'), remove_blank_text=True):
+        if elem.tag == 'text':
+            in_text += 1 if event == 'start' else -1
+        elif event == 'start':
+            if in_text and p_elem is None:
+                p_elem = elem
+        elif elem is p_elem:
+            yield paragraph_from_element(elem)
+            p_elem = None
+            discard(elem)
+
+
+def iter_sentences(tei_xml_file: Path) -> Generator[Sentence]:
+    """Iterates through the sentences of a TEI XML file."""
+    for paragraph in read_tei(tei_xml_file):
+        yield from paragraph.sentences
+
+
+def iter_tokens(tei_xml_file: Path) -> Generator[Token]:
+    """Iterates through the tokens of a TEI XML file."""
+    for paragraph in read_tei(tei_xml_file):
+        for sentence in paragraph.sentences:
+            yield from sentence.tokens
+
+
+def sentences(tei_xml_file: Path) -> Generator[tuple[str, tuple[str, ...]]]:
+    """
+    Iterates through the sentences of a TEI XML file. The file is parsed
+    incrementally (see :func:`read_tei`).
+
+    :return: Yields a tuple of (the space-separated surface forms, the token
+             ids) for each sentence.
+    """
+    for sentence in iter_sentences(tei_xml_file):
+        if sentence.tokens:
+            yield (' '.join(token.form for token in sentence.tokens),
+                   tuple(token.id for token in sentence.tokens))
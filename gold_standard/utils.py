@@ -3,20 +3,174 @@
 
 """Generic utility functions."""
 
-from collections.abc import Iterator
-import itertools
-from typing import TypeVar
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+import os
+from pathlib import Path
+from queue import Queue, SimpleQueue
+from tempfile import NamedTemporaryFile
+import threading
+from typing import IO, Generic, TypeVar
 
 
 T = TypeVar('T')
-U = TypeVar('U')
 
+# Marks the end of the input in the queues of BoundedReader and SerialWorker
+_END = object()
 
-def split_gen(it: Iterator[tuple[T, U]]) -> tuple[Iterator[T], Iterator[U]]:
+
+class _Error:
+    """An exception raised by the input of BoundedReader."""
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class BoundedReader(Generic[T]):
+    """
+    Reads an iterable in a background thread, but only lets _max_in_flight_
+    items be in flight: read, but not yet marked as processed via
+    :meth:`done`. Once the limit is reached, reading stops until the consumer
+    catches up, so memory use does not depend on how far ahead the consumer
+    (e.g. ``nlp.pipe()``) reads.
+
+    The consumer must not need more than _max_in_flight_ items before it
+    calls :meth:`done`, otherwise it deadlocks.
+    """
+    def __init__(self, it: Iterable[T], max_in_flight: int):
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be positive')
+        self.max_in_flight = max_in_flight
+        self._it = it
+        self._slots = threading.Semaphore(max_in_flight)
+        self._queue = SimpleQueue()
+        self._num_read = 0
+        self._num_done = 0
+        self._thread = None
+
+    def _read(self):
+        try:
+            for item in self._it:
+                self._slots.acquire()
+                self._num_read += 1
+                self._queue.put(item)
+        except BaseException as e:
+            self._queue.put(_Error(e))
+        self._queue.put(_END)
+
+    def start(self) -> 'BoundedReader[T]':
+        """
+        Starts reading (up to the limit) before the iteration, e.g. to
+        prefetch the data while the consumer is busy with something else.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read, daemon=True)
+            self._thread.start()
+        return self
+
+    def __iter__(self) -> Iterator[T]:
+        self.start()
+        while (item := self._queue.get()) is not _END:
+            if isinstance(item, _Error):
+                raise item.exception
+            yield item
+
+    def done(self, num_items: int = 1):
+        """Marks _num_items_ items as processed."""
+        self._num_done += num_items
+        for _ in range(num_items):
+            self._slots.release()
+
+    @property
+    def in_flight(self) -> int:
+        """The number of items read, but not yet processed."""
+        return self._num_read - self._num_done
+
+
+class SerialWorker:
     """
-    Splits the iterator _it_ of tuples into two.
+    Runs functions in a background thread, one after the other, in the order
+    they were submitted (e.g. to write the output while the main thread
+    computes the next piece).
 
-    From https://stackoverflow.com/questions/28030095/.
+    If a function raises an exception, the functions submitted after it are
+    skipped, and the exception is re-raised in the main thread by the next
+    :meth:`submit` or by :meth:`close`.
     """
-    it_a, it_b = itertools.tee(it, 2)
-    return (a for a, _ in it_a), (b for _, b in it_b)
+    def __init__(self, max_pending: int = 0):
+        """
+        :param max_pending: :meth:`submit` blocks if this many functions are
+                            waiting to be run; 0 means no limit.
+        """
+        self._queue = Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (task := self._queue.get()) is not _END:
+            if self._error is None:
+                fn, args = task
+                try:
+                    fn(*args)
+                except BaseException as e:
+                    self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, fn: Callable, *args):
+        """Schedules ``fn(*args)``."""
+        self._raise_error()
+        self._queue.put((fn, args))
+
+    def close(self):
+        """Waits until the submitted functions are run."""
+        self._queue.put(_END)
+        self._thread.join()
+        self._raise_error()
+
+    def __enter__(self) -> 'SerialWorker':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # The exception of the main thread takes precedence
+            self._queue.put(_END)
+            self._thread.join()
+
+
+def _umask() -> int:
+    # The umask can only be read by setting it
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_write(file: Path, mode: str = 'wb', **kwargs) -> Iterator[IO]:
+    """
+    Writes _file_ atomically: the contents are written to a temporary file in
+    the same directory, which replaces _file_ once it is complete, and is
+    removed if an exception is raised. The file gets the permissions of a
+    newly created file (0666 minus the umask), not the 0600 of temporary
+    files. _mode_ and _kwargs_ are passed to
+    :class:`tempfile.NamedTemporaryFile`.
+    """
+    file = Path(file)
+    with NamedTemporaryFile(mode, dir=file.parent, delete=False, **kwargs) as outf:
+        try:
+            yield outf
+            os.fchmod(outf.fileno(), 0o666 & ~_umask())
+        except BaseException:
+            os.unlink(outf.name)
+            raise
+    os.replace(outf.name, file)
+
+
+def resident_memory() -> int:
+    """The resident set size of the current process in bytes (Linux only)."""
+    with open('/proc/self/statm') as inf:
+        return int(inf.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
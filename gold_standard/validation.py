@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Validation rules for the gold standard TEI XML files.
+
+Each rule is a visitor: a subclass of :class:`Rule` that overrides some of
+the ``visit_*`` hooks and is registered with :func:`register`. All the rules
+are run in a single, streaming pass over a file (see :func:`validate_file`),
+so adding a rule does not add another parse of the corpus. A new instance of
+each rule is created for every file, so the rules can keep per-file state in
+their attributes.
+
+The hooks return (or yield) the messages of the problems found; the
+validator adds the location (the paragraph, sentence and token ids) and the
+rule to them. :meth:`Rule.visit_token` is called for every token with every
+rule, so the built-in rules return a tuple from it instead of creating a
+generator.
+
+The issues depend only on the contents of a file, so they can be cached by
+the git blob hash of the file (see :class:`ResultCache`).
+"""
+
+from collections.abc import Iterable, Iterator
+import json
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+from gold_standard import backend, tei
+from gold_standard.backend import ParseError
+from gold_standard.cache import file_hash
+from gold_standard.tei import JOIN_VALUES, LEFT, RIGHT, Paragraph, Sentence, Token, read_tei
+from gold_standard.utils import atomic_write
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Registered rule classes by name, in the order of registration
+RULES: dict[str, type['Rule']] = {}
+
+# The name of the pseudo rule that reports files that cannot be read
+PARSE_RULE = 'parse'
+
+
+class Issue(NamedTuple):
+    """A problem found in a file."""
+    rule: str
+    severity: str
+    # The ids of the element the problem is in (None if not applicable)
+    paragraph: str | None
+    sentence: str | None
+    token: str | None
+    message: str
+
+
+class Rule:
+    """
+    The base class of the validation rules. The hooks are called in document
+    order: :meth:`visit_paragraph` before the sentences of the paragraph,
+    :meth:`visit_sentence` before the tokens of the sentence (the sentence
+    has been read entirely by then) and :meth:`end_file` after everything.
+    The hooks that are not overridden are not called at all.
+    """
+    # The name of the rule (used to select it and in the reports)
+    name = ''
+    severity = ERROR
+
+    def visit_paragraph(self, paragraph: Paragraph) -> Iterable[str]:
+        return ()
+
+    def visit_sentence(self, sentence: Sentence) -> Iterable[str]:
+        return ()
+
+    def visit_token(self, token: Token, prev_token: Token | None,
+                    next_token: Token | None) -> Iterable[str]:
+        """
+        :param prev_token: the previous token in the sentence, if any.
+        :param next_token: the next token in the sentence, if any.
+        """
+        return ()
+
+    def end_file(self) -> Iterable[str]:
+        return ()
+
+
+def register(rule_class: type[Rule]) -> type[Rule]:
+    """Registers a rule class (can be used as a decorator)."""
+    if not rule_class.name:
+        raise ValueError(f'{rule_class.__name__} has no name')
+    if rule_class.name in RULES or rule_class.name == PARSE_RULE:
+        raise ValueError(f'Duplicate rule name {rule_class.name}')
+    RULES[rule_class.name] = rule_class
+    return rule_class
+
+
+def _overrides(rule: Rule, hook: str) -> bool:
+    return getattr(type(rule), hook) is not getattr(Rule, hook)
+
+
+def validate(paragraphs: Iterable[Paragraph], rules: Iterable[Rule]) -> Iterator[Issue]:
+    """Runs _rules_ on _paragraphs_ (the contents of a file)."""
+    rules = list(rules)
+    paragraph_rules = [rule for rule in rules if _overrides(rule, 'visit_paragraph')]
+    sentence_rules = [rule for rule in rules if _overrides(rule, 'visit_sentence')]
+    token_rules = [(rule, rule.visit_token) for rule in rules
+                   if _overrides(rule, 'visit_token')]
+    end_rules = [rule for rule in rules if _overrides(rule, 'end_file')]
+
+    for paragraph in paragraphs:
+        p_id = paragraph.id
+        for rule in paragraph_rules:
+            for message in rule.visit_paragraph(paragraph):
+                yield Issue(rule.name, rule.severity, p_id, None, None, message)
+        for sentence in paragraph.sentences:
+            s_id = sentence.id
+            for rule in sentence_rules:
+                for message in rule.visit_sentence(sentence):
+                    yield Issue(rule.name, rule.severity, p_id, s_id, None, message)
+            if not token_rules:
+                continue
+            tokens = sentence.tokens
+            num_tokens = len(tokens)
+            prev_token = None
+            for i, token in enumerate(tokens, 1):
+                next_token = tokens[i] if i < num_tokens else None
+                for rule, visit_token in token_rules:
+                    for message in visit_token(token, prev_token, next_token):
+                        yield Issue(rule.name, rule.severity, p_id, s_id, token.id, message)
+                prev_token = token
+    for rule in end_rules:
+        for message in rule.end_file():
+            yield Issue(rule.name, rule.severity, None, None, None, message)
+
+
+def validate_file(tei_xml_file: Path, rule_names: Iterable[str] | None = None) -> Iterator[Issue]:
+    """
+    Runs the rules in _rule_names_ (all registered rules by default) on
+    _tei_xml_file_ in a single pass. If the file cannot be read, the issues
+    found up to that point are followed by an error of the ``parse`` rule.
+    """
+    rules = [RULES[name]() for name in (RULES if rule_names is None else rule_names)]
+    try:
+        yield from validate(read_tei(tei_xml_file), rules)
+    except (ParseError, OSError) as e:
+        yield Issue(PARSE_RULE, ERROR, None, None, None, f'{type(e).__name__}: {e}')
+
+
+class ResultCache:
+    """
+    The issues found in file contents, keyed by their git blob hash (see
+    :func:`gold_standard.git.blob_hash`), so only new or changed files have
+    to be validated again. The entries also depend on the rules selected and
+    the version of the code that parses and checks the files (this module,
+    gold_standard.tei and gold_standard.backend, and the XML backend used);
+    those of other versions are dropped on load.
+
+    The cache is a JSON lines file with one record per entry. New records
+    are collected by :meth:`put` and appended by :meth:`flush` with a single
+    write; the file is compacted when loaded.
+    """
+    # Changes to the rules or to the parsing invalidate the cache
+    VERSION = ' '.join([backend.BACKEND] + [
+        file_hash(Path(file)) for file in (backend.__file__, tei.__file__, __file__)])
+
+    def __init__(self, cache_file: Path, rule_names: Iterable[str] | None = None):
+        self.cache_file = Path(cache_file)
+        self.rules = sorted(RULES if rule_names is None else rule_names)
+        self.records = self._load()
+        self._pending = []
+        self._compact()
+
+    def _load(self) -> dict[tuple[str, tuple[str, ...]], dict]:
+        records = {}
+        try:
+            with open(self.cache_file, encoding='utf-8') as inf:
+                for line in inf:
+                    try:
+                        record = json.loads(line)
+                        if record['version'] == self.VERSION:
+                            records[record['blob'], tuple(record['rules'])] = record
+                    except (ValueError, KeyError, TypeError):
+                        # E.g. a partially written last line
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _compact(self):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.cache_file, 'wt', encoding='utf-8') as outf:
+            for record in self.records.values():
+                outf.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def get(self, blob: str) -> list[Issue] | None:
+        """The issues found in the contents with hash _blob_, if cached."""
+        record = self.records.get((blob, tuple(self.rules)))
+        if record is None:
+            return None
+        return [Issue(*issue) for issue in record['issues']]
+
+    def put(self, blob: str, issues: list[Issue]):
+        """Caches the _issues_ found in the contents with hash _blob_."""
+        record = {'blob': blob, 'rules': self.rules, 'version': self.VERSION,
+                  'issues': issues}
+        self.records[blob, tuple(self.rules)] = record
+        self._pending.append(record)
+
+    def flush(self):
+        """Appends the records added since the last flush to the cache file."""
+        if not self._pending:
+            return
+        with open(self.cache_file, 'a', encoding='utf-8') as outf:
+            outf.write(''.join(json.dumps(record, ensure_ascii=False) + '\n'
+                               for record in self._pending))
+        self._pending = []
+
+
+def _describe(token: Token) -> str:
+    return f'Token ({token.id}) \'{token.form}\''
+
+
+@register
+class StructureRule(Rule):
+    """The file has paragraphs, the paragraphs sentences, the sentences tokens."""
+    name = 'structure'
+
+    def __init__(self):
+        self.num_paragraphs = 0
+
+    def visit_paragraph(self, paragraph):
+        self.num_paragraphs += 1
+        if len(paragraph.sentences) == 0:
+            yield 'Empty paragraph'
+
+    def visit_sentence(self, sentence):
+        if len(sentence.tokens) == 0:
+            yield 'Empty sentence'
+
+    def end_file(self):
+        if self.num_paragraphs == 0:
+            yield 'No paragraph found'
+
+
+@register
+class IdRule(Rule):
+    """
+    The paragraph, sentence and token ids are present, unique and follow the
+    ``{p,s,t}{N}`` pattern with growing numbers. The parts of a split
+    element (``t{N}_{M}``) share the number of the original; their order is
+    not checked.
+    """
+    name = 'ids'
+    PATTERNS = {kind: re.compile(rf'{kind}(?P<number>\d+)(?:_\d+)?')
+                for kind in ('p', 's', 't')}
+    NAMES = {'p': 'paragraph', 's': 'sentence', 't': 'token'}
+
+    def __init__(self):
+        self.seen = set()
+        self.last_number = {kind: -1 for kind in self.PATTERNS}
+
+    def _check(self, kind: str, xml_id: str | None) -> tuple[str, ...]:
+        if xml_id is None:
+            return (f'The {self.NAMES[kind]} has no xml:id',)
+        messages = ()
+        if xml_id in self.seen:
+            messages = (f'Duplicate xml:id {xml_id}',)
+        self.seen.add(xml_id)
+        m = self.PATTERNS[kind].fullmatch(xml_id)
+        if m is None:
+            return messages + (f'Invalid {self.NAMES[kind]} id {xml_id}',)
+        number = int(m.group('number'))
+        if number < self.last_number[kind]:
+            messages += (f'The {self.NAMES[kind]} id {xml_id} is out of order',)
+        self.last_number[kind] = number
+        return messages
+
+    def visit_paragraph(self, paragraph):
+        return self._check('p', paragraph.id)
+
+    def visit_sentence(self, sentence):
+        return self._check('s', sentence.id)
+
+    def visit_token(self, token, prev_token, next_token):
+        xml_id = token.id
+        # The common case without the regex (\d is isdecimal() for str)
+        if xml_id is not None and xml_id[:1] == 't' and xml_id[1:].isdecimal() \
+                and xml_id not in self.seen:
+            number = int(xml_id[1:])
+            if number >= self.last_number['t']:
+                self.seen.add(xml_id)
+                self.last_number['t'] = number
+                return ()
+        return self._check('t', xml_id)
+
+
+@register
+class FormRule(Rule):
+    """The tokens have a non-empty form."""
+    name = 'form'
+
+    def visit_token(self, token, prev_token, next_token):
+        if len(token.form) == 0:
+            return (f'Token ({token.id}) has an empty form',)
+        return ()
+
+
+@register
+class JoinRule(Rule):
+    """
+    The join attributes have a valid value and are consistent: a token that
+    joins its neighbour must have a neighbour that joins it back.
+    """
+    name = 'join'
+
+    def visit_token(self, token, prev_token, next_token):
+        join = token.join
+        # The common case: no join on either side of the next boundary
+        if join == 'no' and next_token is not None and next_token.join not in LEFT:
+            return ()
+        messages = []
+        if join not in JOIN_VALUES:
+            messages.append(f'{_describe(token)} has an invalid join value ({join})')
+        if prev_token is None and join in LEFT:
+            messages.append(f'{_describe(token)} requires a left join ({join})'
+                            f' but has no left neighbour')
+        if next_token is None:
+            if join in RIGHT:
+                messages.append(f'{_describe(token)} requires a right join ({join})'
+                                f' but has no right neighbour')
+        # Every adjacent pair is checked once, at its left token
+        elif (join in RIGHT) != (next_token.join in LEFT):
+            if join in RIGHT:
+                messages.append(f'{_describe(token)} wants to join right ({join}),'
+                                f' but \'{next_token.form}\' does not accept a left join ({next_token.join})')
+            else:
+                messages.append(f'{_describe(next_token)} wants to join left ({next_token.join}),'
+                                f' but \'{token.form}\' does not accept a right join ({join})')
+        return messages
+
+
+@register
+class AnalysisRule(Rule):
+    """The tokens have a <morph> with at least one <ana>, exactly one of them correct."""
+    name = 'analyses'
+
+    def visit_token(self, token, prev_token, next_token):
+        if token.check is None:
+            return (f'{_describe(token)} has no morph tag',)
+        if len(token.analyses) == 0:
+            return (f'{_describe(token)} has no analyses',)
+        num_correct = 0
+        for ana in token.analyses:
+            num_correct += ana.correct
+        if num_correct != 1:
+            return (f'{_describe(token)} has {num_correct} correct analyses',)
+        return ()
+
+
+@register
+class CheckRule(Rule):
+    """The analyses of the tokens have been checked (<morph check="True">)."""
+    name = 'check'
+    severity = WARNING
+
+    def visit_token(self, token, prev_token, next_token):
+        if token.check is False:
+            return (f'{_describe(token)} is not checked',)
+        return ()
+
+
+@register
+class FieldRule(Rule):
+    """The lemma and the simple analysis of the correct analysis are not empty."""
+    name = 'fields'
+
+    def visit_token(self, token, prev_token, next_token):
+        ana = token.correct
+        if ana is None or (ana.lemma and ana.simple):
+            return ()
+        missing = [field for field in ('lemma', 'simple') if len(getattr(ana, field)) == 0]
+        return (f'{_describe(token)} has an empty {" and ".join(missing)}',)
@@ -1,20 +1,554 @@
 import sys
 import argparse
-import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from itertools import combinations
+import json
+import math
+import multiprocessing
+import os
+from pathlib import Path
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+from gold_standard.cache import corpus_files
+from gold_standard.splits import genre
+from gold_standard.tei import iter_sentences, iter_tokens, spaces_from_joins
+
+# Az összehasonlított elemzési kategóriák
+CATEGORIES = ("lemma", "detailed", "simple")
+# A helyes elemzés nélküli tokenek címkéje minden kategóriában
+NO_ANALYSIS = "[nincs helyes elemzés]"
+
+DEFAULT_CORPUS_DIR = Path(__file__).parent.parent / "corpus" / "Morph annotated"
+
+# Egy annotátor fájljának neve: {dokumentum}_annot{N}.xml
+ANNOTATOR_FILE = re.compile(r"(?P<document>.+)_annot(?P<annotator>\d+)")
+# Token id: t{N}, a szétválasztott tokeneké t{N}_{M}
+TOKEN_ID = re.compile(r"t(?P<number>\d+)(?:_\d+)?")
+
+# A --confusion kimeneti formátumai
+TABLE_FORMATS = ("json", "csv", "parquet")
+
+# A bootstrap újramintavételezések egy adagjában legfeljebb ennyi (újramintavételezés × token/címke) elem
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 21
 
 
 def parse_user_input():
     parser = argparse.ArgumentParser(description="Kiszámolja a két annotátor közti várható- és "
-                                                 "véletlenszerű megegyezés értékét",
-                                     usage=f'{__file__} ')
-    parser.add_argument(dest="target_files", nargs=2, metavar="FILES",
-                        help="Add meg az egyes annotátorokhoz tartozó fájlokat egymás után felsorolva.")
+                                                 "véletlenszerű megegyezés értékét")
+    parser.add_argument(dest="target_files", nargs="*", metavar="FILES",
+                        help="Add meg az egyes annotátorokhoz tartozó fájlokat egymás után felsorolva. Kettőnél "
+                             "több fájl esetén Fleiss-féle kappát és Krippendorff-féle alfát számol.")
+    parser.add_argument("--multi", "-m", action="store_true",
+                        help="Két fájl esetén is Fleiss-féle kappát és Krippendorff-féle alfát számol.")
+    parser.add_argument("--corpus", "-c", dest="corpus_dir", type=Path, nargs="?", const=DEFAULT_CORPUS_DIR,
+                        help="Kötegelt mód: a könyvtár (alapértelmezés: corpus/Morph annotated) összes többszörösen "
+                             "annotált (_annotN) dokumentumának minden annotátor-párját összeveti, és "
+                             "dokumentumonként, műfajonként és összesítve is kiírja a megegyezést.")
+    parser.add_argument("--output", "-o", type=Path,
+                        help="A különbségek fájlja (alapértelmezés: annotator_differences.txt); kötegelt módban "
+                             "a könyvtár, ahová páronként egy fájl kerül (alapértelmezés: annotator_differences).")
+    parser.add_argument("--align", "-a", action="store_true",
+                        help="A módosított szóalakú és az eltérően tokenizált tokeneket nem hagyja ki: a két "
+                             "annotátor tokenjeit a szóalakokból és a join attribútumokból számolt karakterpozíciók "
+                             "alapján illeszti, és az illesztett szakaszokat is összeveti. Két fájl esetén és "
+                             "kötegelt módban használható.")
+    parser.add_argument("--stream", "-s", action="store_true",
+                        help="Két fájl esetén a fájlokat párhuzamosan, tokenenként olvassa és a token id-k alapján "
+                             "fésüli össze, így a memóriahasználat nem függ a fájlok méretétől. A különbségek "
+                             "dokumentum-sorrendben kerülnek a fájlba.")
+    parser.add_argument("--confusion", "-x", type=Path, metavar="PREFIX",
+                        help="Kategóriánként (lemma, detailed, simple) kiírja a ritka konfúziós mátrixot, a címkénkénti "
+                             "kappát és a megegyezést a PREFIX.json, illetve a PREFIX.{agreement,confusion,labels}.csv "
+                             "/ .parquet fájlokba. Kötegelt módban minden dokumentumra, műfajra és az összesítésre.")
+    parser.add_argument("--format", "-f", choices=TABLE_FORMATS, default="json",
+                        help="A --confusion kimenetének formátuma (alapértelmezés: json; a parquet-hez pyarrow kell).")
+    parser.add_argument("--bootstrap", "-b", type=int, metavar="RESAMPLES",
+                        help="Két fájl esetén a megadott számú, mondatonkénti bootstrap újramintavételezéssel "
+                             "konfidenciaintervallumot is számol p_o-ra, p_e-re és a kappára (pl. 10000).")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="A konfidenciaintervallumok szintje (alapértelmezés: 0.95).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="A bootstrap véletlenszám-generátorának kezdőértéke (alapértelmezés: 0).")
+    parser.add_argument("--processes", "-P", type=int, default=1,
+                        help="A párhuzamos folyamatok száma kötegelt módban és a bootstraphez (legfeljebb a magok "
+                             "száma, alapértelmezés: 1).")
 
     options = parser.parse_args()
-    if not len(options.target_files):
+    if options.corpus_dir is None and len(options.target_files) < 2:
         parser.print_help(sys.stderr)
         exit(2)
-    return options.target_files
+    num_procs = len(os.sched_getaffinity(0))
+    if options.processes < 1 or options.processes > num_procs:
+        parser.error(f"A folyamatok száma 1 és {num_procs} között lehet.")
+    if options.align and (options.stream or options.multi or len(options.target_files) > 2):
+        parser.error("Az --align csak két fájl alapértelmezett módú összevetésével vagy kötegelt módban használható.")
+    if options.bootstrap is not None:
+        if options.bootstrap < 1:
+            parser.error("Az újramintavételezések száma pozitív kell legyen.")
+        if options.corpus_dir is not None or options.stream or options.multi or len(options.target_files) > 2:
+            parser.error("A bootstrap csak két fájl alapértelmezett módú összevetésével használható.")
+    if options.confusion is not None and options.corpus_dir is None and (
+            options.stream or options.multi or len(options.target_files) > 2):
+        parser.error("A --confusion csak két fájl alapértelmezett módú összevetésével vagy kötegelt módban "
+                     "használható.")
+    if options.confusion is not None and options.format == "parquet":
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            parser.error("A parquet formátumhoz a pyarrow csomag szükséges (pip install pyarrow).")
+    if not 0 < options.confidence < 1:
+        parser.error("A konfidenciaszint 0 és 1 közé kell essen.")
+    return options
+
+
+def encode_labels(values, codebook):
+    """
+        Egész számokká kódolja a címkéket: az azonos címkék azonos kódot kapnak. A codebook több
+        annotátor vagy fájl (akár a teljes korpusz) között is megosztható.
+        :param values: címkék (str vagy None)
+        :param codebook: { címke: kód }, az új címkékkel bővül
+        :return: a címkék kódjai (int64 tömb)
+    """
+    return np.fromiter((codebook.setdefault(value, len(codebook)) for value in values), dtype=np.int64)
+
+
+def cohen_kappa(a, b, num_labels=None):
+    """
+        Cohen-féle kappa két annotátor kódolt címkéiből. A megfigyelt megegyezés az egyező kódok aránya,
+        a véletlenszerű megegyezés a két annotátor címkegyakoriságainak (bincount) szorzatösszege / all^2.
+        :param a: az 1es annotátor címkéinek kódjai
+        :param b: a 2es annotátor címkéinek kódjai (tokenenként azonos sorrendben)
+        :param num_labels: a kódok száma (alapértelmezés: a legnagyobb kód + 1)
+        :return: (p_o, p_e, kappa)
+    """
+    if num_labels is None:
+        num_labels = int(max(a.max(initial=-1), b.max(initial=-1))) + 1
+    return kappa_from_counts(len(a), int(np.count_nonzero(a == b)),
+                             int(np.dot(np.bincount(a, minlength=num_labels), np.bincount(b, minlength=num_labels))))
+
+
+def kappa_from_counts(all, matches, expected_matches):
+    """
+        Cohen-féle kappa a darabszámokból. Egész számokkal pontos, így az eredmény nem függ attól, hogy milyen
+        sorrendben számoltuk össze a címkéket.
+        :param all: a tokenek száma
+        :param matches: az egyező címkék száma
+        :param expected_matches: a címkék gyakoriságainak szorzatösszege (sum(count_a[l] * count_b[l]))
+        :return: (p_o, p_e, kappa)
+    """
+    p_o = matches / all
+    p_e = expected_matches / (all * all)
+    return p_o, p_e, (p_o - p_e) / (1 - p_e)
+
+
+def confusion_matrix(a, b, num_labels):
+    """
+        Ritka (koordináta formátumú) konfúziós mátrix egyetlen menetben: a (címke a, címke b) párokat
+        egyetlen egész kulcsként számolja meg.
+        :param a: az 1es annotátor címkéinek kódjai
+        :param b: a 2es annotátor címkéinek kódjai
+        :param num_labels: a kódok száma
+        :return: (sorok: címkekódok a, oszlopok: címkekódok b, darabszámok), csak a nem nulla cellák
+    """
+    keys, counts = np.unique(a * num_labels + b, return_counts=True)
+    return keys // num_labels, keys % num_labels, counts
+
+
+def label_kappas(a, b, num_labels):
+    """
+        Címkénkénti Cohen-féle kappa: minden címkére a "ez a címke / más címke" döntés megegyezése.
+        :param a: az 1es annotátor címkéinek kódjai
+        :param b: a 2es annotátor címkéinek kódjai
+        :param num_labels: a kódok száma
+        :return: (címkekódok, darabszám a, darabszám b, egyezések, p_o, p_e, kappa), csak az előforduló címkékre
+    """
+    all = len(a)
+    counts_a = np.bincount(a, minlength=num_labels)
+    counts_b = np.bincount(b, minlength=num_labels)
+    matches = np.bincount(a[a == b], minlength=num_labels)
+    labels = np.flatnonzero(counts_a + counts_b)
+    counts_a, counts_b, matches = counts_a[labels], counts_b[labels], matches[labels]
+    p_o = (all - counts_a - counts_b + 2 * matches) / all
+    p_e = (counts_a * counts_b + (all - counts_a) * (all - counts_b)) / all ** 2
+    # Ha mindkét annotátor minden tokenre ezt a címkét adta, p_e = 1 és a kappa nem értelmezett (NaN)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kappa = (p_o - p_e) / (1 - p_e)
+    return labels, counts_a, counts_b, matches, p_o, p_e, kappa
+
+
+def agreement_tables(groups, codebooks):
+    """
+        A megegyezés táblázatai oszlopos formában (oszlopnév -> értékek), gépi feldolgozáshoz.
+        :param groups: [ (szint, név, { kategória: (címkék kódjai a, címkék kódjai b) }) ]
+        :param codebooks: { kategória: { címke: kód } }, amivel a címkéket kódolták
+        :return: { "agreement": kategóriánként p_o, p_e, kappa;
+                   "confusion": a konfúziós mátrixok nem nulla cellái;
+                   "labels": címkénkénti darabszámok és kappa }
+    """
+    tables = {
+        "agreement": {column: [] for column in ("level", "name", "category", "tokens", "p_o", "p_e", "kappa")},
+        "confusion": {column: [] for column in ("level", "name", "category", "label_a", "label_b", "count")},
+        "labels": {column: [] for column in ("level", "name", "category", "label", "count_a", "count_b",
+                                             "matches", "p_o", "p_e", "kappa")},
+    }
+    for level, name, codes in groups:
+        for element in CATEGORIES:
+            a, b = codes[element]
+            num_labels = len(codebooks[element])
+            labels = list(codebooks[element])
+            columns = {"level": level, "name": name, "category": element}
+
+            table = tables["agreement"]
+            for column, value in zip(("tokens", "p_o", "p_e", "kappa"), (len(a), *cohen_kappa(a, b, num_labels))):
+                table[column].append(value)
+
+            rows, cols, counts = confusion_matrix(a, b, num_labels)
+            table = tables["confusion"]
+            table["label_a"].extend(labels[i] for i in rows.tolist())
+            table["label_b"].extend(labels[i] for i in cols.tolist())
+            table["count"].extend(counts.tolist())
+
+            label_codes, *values = label_kappas(a, b, num_labels)
+            table = tables["labels"]
+            table["label"].extend(labels[i] for i in label_codes.tolist())
+            for column, value in zip(("count_a", "count_b", "matches", "p_o", "p_e", "kappa"), values):
+                table[column].extend(value.tolist())
+
+            for table, num_rows in ((tables["agreement"], 1), (tables["confusion"], len(counts)),
+                                    (tables["labels"], len(label_codes))):
+                for column, value in columns.items():
+                    table[column].extend([value] * num_rows)
+    return tables
+
+
+def write_tables(tables, prefix, output_format="json"):
+    """
+        Kiírja az agreement_tables táblázatait: json formátumban egyetlen PREFIX.json fájlba (táblázatonként a
+        sorok listája), csv és parquet formátumban táblázatonként egy PREFIX.{táblázat}.{formátum} fájlba.
+        A NaN értékek helyére null / üres mező kerül.
+        :param tables: agreement_tables kimenete
+        :param prefix: a kimeneti fájlok közös előtagja
+        :param output_format: json, csv vagy parquet
+    """
+    prefix = Path(prefix)
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    tables = {name: {column: [None if isinstance(value, float) and math.isnan(value) else value
+                              for value in values]
+                     for column, values in table.items()}
+              for name, table in tables.items()}
+
+    if output_format == "json":
+        with open(f"{prefix}.json", "w", encoding="utf-8") as file:
+            json.dump({name: [dict(zip(table, row)) for row in zip(*table.values())]
+                       for name, table in tables.items()}, file, ensure_ascii=False, indent=1)
+    elif output_format == "csv":
+        for name, table in tables.items():
+            with open(f"{prefix}.{name}.csv", "w", encoding="utf-8", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(table)
+                writer.writerows(zip(*table.values()))
+    elif output_format == "parquet":
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("A parquet formátumhoz a pyarrow csomag szükséges (pip install pyarrow).") from None
+        for name, table in tables.items():
+            pyarrow.parquet.write_table(pyarrow.table(table), f"{prefix}.{name}.parquet")
+    else:
+        raise ValueError(f"Ismeretlen formátum: {output_format}")
+
+
+class BootstrapData(NamedTuple):
+    """A bootstrap bemenete: mondatok szerint rendezett, kódolt címkék."""
+    # Az egyes mondatok első tokenjének indexe és a tokenjeik száma
+    starts: np.ndarray
+    lengths: np.ndarray
+    # { kategória: (címkék a, címkék b, egyezések, kódok száma) }; a csak az egyik annotátornál előforduló
+    # címkék közös, utolsó kódot kapnak, ami a véletlenszerű megegyezésbe nem számít bele
+    codes: dict
+
+
+def bootstrap_data(codes, sentences):
+    """
+        Előkészíti a bootstrap bemenetét.
+        :param codes: { kategória: (címkék kódjai a, címkék kódjai b) }
+        :param sentences: tokenenként a mondat sorszáma
+    """
+    order = np.argsort(sentences, kind="stable")
+    _, lengths = np.unique(sentences[order], return_counts=True)
+    starts = np.cumsum(lengths) - lengths
+    reduced = dict()
+    for element, (a, b) in codes.items():
+        a, b = a[order], b[order]
+        # Csak a mindkét annotátornál előforduló címkék számítanak p_e-be
+        shared = np.intersect1d(a, b)
+        mapping = np.full(int(max(a.max(initial=-1), b.max(initial=-1))) + 1, len(shared))
+        mapping[shared] = np.arange(len(shared))
+        reduced[element] = (mapping[a], mapping[b], a == b, len(shared) + 1)
+    return BootstrapData(starts, lengths, reduced)
+
+
+def bootstrap_resamples(data, seed, size):
+    """
+        _size_ darab mondatonkénti bootstrap újramintavételezés: minden újramintavételezés visszatevéssel
+        annyi mondatot húz, ahány mondat van. A húzások egész indextömbök, amikből a tokenek indexe és az
+        újramintavételezés sorszáma alapján bincount adja a darabszámokat.
+        :param data: bootstrap_data kimenete
+        :param seed: a véletlenszám-generátor kezdőértéke (np.random.SeedSequence)
+        :return: (size, kategóriák, 3) tömb: újramintavételezésenként és kategóriánként (p_o, p_e, kappa)
+    """
+    rng = np.random.default_rng(seed)
+    num_sentences = len(data.lengths)
+    draws = rng.integers(num_sentences, size=(size, num_sentences))
+    lengths = data.lengths[draws].ravel()
+    resample_lengths = lengths.reshape(size, num_sentences).sum(axis=1)
+    # Az újramintavételezések tokenjeinek indexe és az újramintavételezés sorszáma tokenenként
+    within_sentence = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    tokens = np.repeat(data.starts[draws].ravel(), lengths) + within_sentence
+    resample = np.repeat(np.arange(size), resample_lengths)
+
+    results = np.empty((size, len(data.codes), 3))
+    for i, (a, b, matches, num_labels) in enumerate(data.codes.values()):
+        a, b = a[tokens], b[tokens]
+        matches = np.bincount(resample[matches[tokens]], minlength=size)
+        counts_a = np.bincount(resample * num_labels + a, minlength=size * num_labels).reshape(size, num_labels)
+        counts_b = np.bincount(resample * num_labels + b, minlength=size * num_labels).reshape(size, num_labels)
+        expected_matches = np.einsum("ij,ij->i", counts_a[:, :-1], counts_b[:, :-1])
+        results[:, i, 0] = matches / resample_lengths
+        results[:, i, 1] = expected_matches / resample_lengths.astype(np.float64) ** 2
+    results[:, :, 2] = (results[:, :, 0] - results[:, :, 1]) / (1 - results[:, :, 1])
+    return results
+
+
+# A bootstrap folyamatainak bemenete (lásd _init_bootstrap_worker)
+_bootstrap_data = None
+
+
+def _init_bootstrap_worker(data):
+    global _bootstrap_data
+    _bootstrap_data = data
+
+
+def _bootstrap_in_worker(seed, size):
+    return bootstrap_resamples(_bootstrap_data, seed, size)
+
+
+def bootstrap_intervals(codes, sentences, resamples=10000, seed=0, processes=1, confidence=0.95):
+    """
+        Mondatonkénti bootstrap (percentilis) konfidenciaintervallumok a Cohen-féle kappához.
+        Az újramintavételezések rögzített méretű adagokban, adagonként külön (a seed-ből származtatott)
+        véletlenszám-generátorral futnak, így az eredmény nem függ a folyamatok számától.
+        :param codes: { kategória: (címkék kódjai a, címkék kódjai b) }
+        :param sentences: tokenenként a mondat sorszáma
+        :param resamples: az újramintavételezések száma
+        :param seed: a véletlenszám-generátor kezdőértéke
+        :param processes: a párhuzamos folyamatok száma
+        :param confidence: a konfidenciaszint
+        :return: { kategória: ((p_o alsó, felső), (p_e alsó, felső), (kappa alsó, felső)) }
+    """
+    data = bootstrap_data(codes, sentences)
+    num_tokens = int(data.lengths.sum())
+    max_labels = max(num_labels for _, _, _, num_labels in data.codes.values())
+    chunk_size = max(1, BOOTSTRAP_CHUNK_ELEMENTS // (num_tokens + max_labels))
+    sizes = [min(chunk_size, resamples - start) for start in range(0, resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if processes == 1:
+        chunks = [bootstrap_resamples(data, chunk_seed, size) for chunk_seed, size in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_bootstrap_worker, initargs=(data,)) as executor:
+            chunks = list(executor.map(_bootstrap_in_worker, seeds, sizes))
+
+    bounds = np.quantile(np.concatenate(chunks), [(1 - confidence) / 2, (1 + confidence) / 2], axis=0)
+    return {element: tuple((float(bounds[0, i, j]), float(bounds[1, i, j])) for j in range(3))
+            for i, element in enumerate(codes)}
+
+
+def sentence_numbers(annotator_file):
+    """
+        A tokenek mondatának sorszáma.
+        :param annotator_file: annotátor fájl
+        :return: { token_id: mondat sorszáma }
+    """
+    return {token.id: i for i, sentence in enumerate(iter_sentences(annotator_file)) for token in sentence.tokens}
+
+
+def multi_agreement_counts(codes, num_labels=None):
+    """
+        A Fleiss-féle kappa és a Krippendorff-féle alfa közös darabszámai a token × annotátor címkemátrixból.
+        A tokenenként egyes címkéket választó annotátorok számát (n_uc) a (token, címke) kulcsok
+        megszámolásával kapja, így a költség a tokenek × annotátorok számával arányos, nem az annotátor-párokéval.
+        :param codes: címkekódok mátrixa (token × annotátor)
+        :param num_labels: a kódok száma (alapértelmezés: a legnagyobb kód + 1)
+        :return: (sum_u sum_c n_uc^2, sum_c n_c^2), ahol n_c a c címke összes előfordulása
+    """
+    if num_labels is None:
+        num_labels = int(codes.max(initial=-1)) + 1
+    _, token_label_counts = np.unique(np.arange(len(codes))[:, None] * num_labels + codes, return_counts=True)
+    label_counts = np.bincount(codes.ravel(), minlength=num_labels)
+    return int(np.dot(token_label_counts, token_label_counts)), int(np.dot(label_counts, label_counts))
+
+
+def fleiss_kappa(codes, num_labels=None):
+    """
+        Fleiss-féle kappa: a tokenenkénti egyező annotátor-párok átlagos aránya (p_o) és a címkék
+        összesített gyakoriságából várható arány (p_e) alapján.
+        :param codes: címkekódok mátrixa (token × annotátor)
+        :param num_labels: a kódok száma (alapértelmezés: a legnagyobb kód + 1)
+        :return: (p_o, p_e, kappa); NaN, ami nem értelmezett (nincs token, ill. p_e = 1)
+    """
+    num_tokens, num_annotators = codes.shape
+    if num_tokens == 0:
+        return math.nan, math.nan, math.nan
+    token_agreement, label_agreement = multi_agreement_counts(codes, num_labels)
+    p_o = (token_agreement - num_tokens * num_annotators) / (num_tokens * num_annotators * (num_annotators - 1))
+    p_e = label_agreement / (num_tokens * num_annotators) ** 2
+    return p_o, p_e, ((p_o - p_e) / (1 - p_e) if p_e != 1 else math.nan)
+
+
+def krippendorff_alpha(codes, num_labels=None):
+    """
+        Krippendorff-féle alfa nominális címkékre: 1 - D_o / D_e, ahol a megfigyelt (D_o) és a várható (D_e)
+        eltérés a coincidence mátrix átlón kívüli összegeiből jön. Minden tokent minden annotátor címkéz.
+        :param codes: címkekódok mátrixa (token × annotátor)
+        :param num_labels: a kódok száma (alapértelmezés: a legnagyobb kód + 1)
+        :return: alfa; NaN, ha nem értelmezett (nincs token, ill. csak egyféle címke van)
+    """
+    num_tokens, num_annotators = codes.shape
+    if num_tokens == 0:
+        return math.nan
+    token_agreement, label_agreement = multi_agreement_counts(codes, num_labels)
+    all = num_tokens * num_annotators
+    # sum_{c != k} o_ck * (m - 1), illetve sum_{c != k} n_c * n_k
+    observed = num_tokens * num_annotators ** 2 - token_agreement
+    expected = all * all - label_agreement
+    if expected == 0:
+        return math.nan
+    return 1 - (all - 1) * observed / ((num_annotators - 1) * expected)
+
+
+def form_key(token):
+    """
+        A token módosított szóalakja, vagy False, ha nem módosították. Két annotátor tokenje akkor egyezik,
+        ha ez azonos.
+    """
+    return token.form if token.form_modified and token.form else False
+
+
+def form_differs(token_a, token_b):
+    """
+        Eltér-e a két annotátor tokenje: hiányzik-e valamelyiknél, vagy eltérően módosították a szóalakját.
+        :param token_a: 1es annotátor tokenje vagy None
+        :param token_b: 2es annotátor tokenje vagy None
+    """
+    if token_a is None or token_b is None:
+        return True
+    return form_key(token_a) != form_key(token_b)
+
+
+def analysis_answer(ana):
+    """
+        Egy annotátor válasza: a helyes elemzés értékei. Ha a tokennek nincs helyes elemzése, minden
+        kategóriában a NO_ANALYSIS címke, így az eltérés a különbségek közé kerül.
+        :param ana: a token helyes elemzése (Token.correct) vagy None
+        :return: { lemma, detailed, simple, ana_modified }
+    """
+    if ana is None:
+        return {element: NO_ANALYSIS for element in CATEGORIES} | {"ana_modified": False}
+    return {
+        "lemma": ana.lemma,
+        "detailed": ana.detailed,
+        "simple": ana.simple,
+        "ana_modified": ana.modified
+    }
+
+
+def format_token_difference(token, *tokens):
+    """
+        Egy eltérő token a különbségek fájljában.
+        :param tokens: az egyes annotátorok tokenje vagy None
+    """
+    lines = [f'Token: {token} \tEltérő tokenek.']
+    for i, annotator_token in enumerate(tokens, 1):
+        lines.append(f'Annotátor {i}: {annotator_token.form if annotator_token else None}')
+    return '\n'.join(lines)
+
+
+def format_analysis_difference(token, *answers):
+    """
+        Egy eltérő elemzés a különbségek fájljában.
+        :param answers: az egyes annotátorok válasza (analysis_answer)
+    """
+    lines = [f'Token: {token} \tEltérő elemzés.']
+    for i, answer in enumerate(answers, 1):
+        # Illesztett szakaszoknál (AlignedAgreementCalculator) a szóalakok is
+        form = f'form: {answer["form"]} | ' if "form" in answer else ''
+        lines.append(f'Annotátor {i}:\tana modified={answer["ana_modified"]}\t'
+                     f'({form}lemma: {answer["lemma"]} | detailed: {answer["detailed"]} | simple: {answer["simple"]})')
+    return '\n'.join(lines)
+
+
+def format_agreement(agreement):
+    """
+        A megegyezés értékei szöveges formában.
+        :param agreement: { kategória: (p_o, p_e, kappa) }
+    """
+    po_lemma, pe_lemma, k_lemma = agreement["lemma"]
+    po_detailed, pe_detailed, k_detailed = agreement["detailed"]
+    po_simple, pe_simple, k_simple = agreement["simple"]
+
+    return 'Annotátorok közti megegyezés várható értéke:\n' \
+           f'p_o Lemma: {po_lemma}\n' \
+           f'p_o Detailed: {po_detailed}\n' \
+           f'p_o Simple: {po_simple}\n\n' \
+           'Annotátorok közti véletlenszerű megegyezés értéke:\n' \
+           f'p_e Lemma: {pe_lemma}\n' \
+           f'p_e Detailed: {pe_detailed}\n' \
+           f'p_e Simple: {pe_simple}\n\n' \
+           'Cohen-féle Kappa értéke:\n' \
+           f'k Lemma: {k_lemma}\n' \
+           f'k Detailed: {k_detailed}\n' \
+           f'k Simple: {k_simple}'
+
+
+def format_intervals(intervals, resamples, confidence, seed):
+    """
+        A bootstrap konfidenciaintervallumok szöveges formában.
+        :param intervals: bootstrap_intervals kimenete
+    """
+    lines = [f'Bootstrap konfidenciaintervallumok ({confidence:.0%}, {resamples} mondatonkénti '
+             f'újramintavételezés, seed: {seed}):']
+    for prefix, i in (('p_o', 0), ('p_e', 1), ('k', 2)):
+        lines.extend(f'{prefix} {element.capitalize()}: [{intervals[element][i][0]}, {intervals[element][i][1]}]'
+                     for element in CATEGORIES)
+    return '\n'.join(lines)
+
+
+def format_multi_agreement(agreement, num_annotators, num_tokens):
+    """
+        A több annotátoros megegyezés értékei szöveges formában.
+        :param agreement: { kategória: (p_o, p_e, Fleiss-féle kappa, Krippendorff-féle alfa) }
+    """
+    lines = [f'Annotátorok száma: {num_annotators}, összevetett tokenek száma: {num_tokens}']
+    if num_tokens == 0:
+        lines.append('Nincs összevethető token (amely minden annotátornál megvan azonos szóalakkal), '
+                     'a megegyezés nem számolható.')
+        return '\n'.join(lines)
+    for title, prefix, i in (('Annotátorok közti megegyezés várható értéke:', 'p_o', 0),
+                             ('Annotátorok közti véletlenszerű megegyezés értéke:', 'p_e', 1),
+                             ('Fleiss-féle Kappa értéke:', 'k', 2),
+                             ('Krippendorff-féle alfa értéke:', 'alpha', 3)):
+        lines.append('')
+        lines.append(title)
+        lines.extend(f'{prefix} {element.capitalize()}: {agreement[element][i]}' for element in CATEGORIES)
+    return '\n'.join(lines)
 
 
 class AnnotatorAgreementCalculator:
@@ -22,18 +556,24 @@ class AnnotatorAgreementCalculator:
         Annotátorok közti várható- és véletlenszerű megegyezés értékének kiszámítása.
         Cohen-féle Kappa együttható megállapítása.
     """
-    def __init__(self, annotator_file1, annotator_file2):
+    def __init__(self, annotator_file1, annotator_file2, output_file="annotator_differences.txt", verbose=True):
+        """
+            :param output_file: ide kerülnek a két annotátor közti különbségek
+            :param verbose: kiírja-e a megegyezés értékeit
+        """
         self.token_differences = dict()
-        self.id_attrib = '{http://www.w3.org/XML/1998/namespace}id'
+        self.annotator_file1 = annotator_file1
+        self.annotator_file2 = annotator_file2
 
         a1_tokens = self.parse_xml(annotator_file1)
         a2_tokens = self.parse_xml(annotator_file2)
 
         token_objects = self.create_token_objects(a1_tokens, a2_tokens)
         results = self.extract_results(token_objects)
-        self.calculate_differences(results)
-        self.list_differences(results)
-
+        self.agreement = self.calculate_differences(results)
+        if verbose:
+            print(format_agreement(self.agreement))
+        self.list_differences(results, output_file)
 
     def create_token_objects(self, a, b):
         """
@@ -45,39 +585,17 @@ class AnnotatorAgreementCalculator:
             :return: token_objects = { token_id: token_a, token_b }
         """
         token_objects = dict()
-        each_token = set(
-            [a[token].attrib[self.id_attrib] for token in a] +
-            [b[token].attrib[self.id_attrib] for token in b]
-        )
+        each_token = set(a) | set(b)
         for token in each_token:
-            token_objects[token] = dict()
-            token_objects[token]["modified_a"] = False
-            token_objects[token]["modified_b"] = False
-            if token in a:
-                if a[token][0].attrib["modified"] == 'True':
-                    token_objects[token]["modified_a"] = a[token][0].text
-                token_objects[token]["a"] = a[token]
-                if token in b:
-                    if b[token][0].attrib["modified"] == 'True':
-                        token_objects[token]["modified_b"] = b[token][0].text
-                    token_objects[token]["b"] = b[token]
-                else:
-                    token_objects[token]["b"] = None
-                    self.token_differences[token] = token_objects[token]
-            elif token in b:
-                if b[token][0].attrib["modified"] == 'True':
-                    token_objects[token]["modified_b"] = b[token][0].text
-
-                token_objects[token]["b"] = b[token]
-                token_objects[token]["a"] = None
-                self.token_differences[token] = token_objects[token]
-
-            if token_objects[token]["modified_a"] and token_objects[token]["modified_b"]:
-                if token_objects[token]["modified_a"] != token_objects[token]["modified_b"]:
-                    self.token_differences[token] = token_objects[token]
-            elif token_objects[token]["modified_a"]:
-                self.token_differences[token] = token_objects[token]
-            elif token_objects[token]["modified_b"]:
+            token_a = a.get(token)
+            token_b = b.get(token)
+            token_objects[token] = {
+                "modified_a": token_a.form if token_a is not None and token_a.form_modified else False,
+                "modified_b": token_b.form if token_b is not None and token_b.form_modified else False,
+                "a": token_a,
+                "b": token_b
+            }
+            if form_differs(token_a, token_b):
                 self.token_differences[token] = token_objects[token]
 
         for token in self.token_differences:
@@ -95,29 +613,8 @@ class AnnotatorAgreementCalculator:
         answers = dict()
         for token in token_objects:
             answers[token] = dict()
-            for ana in token_objects[token]["a"][1]:
-                if ana.attrib["correct"] == 'True':
-                    answers[token]["a"] = {
-                        "lemma": ana[0].text,
-                        "detailed": ana[1].text,
-                        "simple": ana[2].text
-                    }
-                    try:
-                        answers[token]["a"]["ana_modified"] = ana.attrib["modified"]
-                    except KeyError:
-                        answers[token]["a"]["ana_modified"] = False
-
-            for ana in token_objects[token]["b"][1]:
-                if ana.attrib["correct"] == 'True':
-                    answers[token]["b"] = {
-                        "lemma": ana[0].text,
-                        "detailed": ana[1].text,
-                        "simple": ana[2].text
-                    }
-                    try:
-                        answers[token]["b"]["ana_modified"] = ana.attrib["modified"]
-                    except KeyError:
-                        answers[token]["b"]["ana_modified"] = False
+            for annotator in ("a", "b"):
+                answers[token][annotator] = analysis_answer(token_objects[token][annotator].correct)
 
             answers[token]["results"] = {
                 "lemma": True if answers[token]["a"]["lemma"] == answers[token]["b"]["lemma"] else False,
@@ -131,79 +628,47 @@ class AnnotatorAgreementCalculator:
         """
         Két annotátor közti megegyezés kiszámítása ( Várható- és véletlenszerű megegyezés)
         Cohen-féle kappa együttható meghatározása
+        A két annotátor címkéi a labels attribútumba kerülnek: { kategória: (címkék a, címkék b) }, a kódjaik
+        a codes attribútumba, a codebooks szerint kódolva
         :param results: results from self.extract_results method
+        :return: { kategória: (p_o, p_e, kappa) }
         """
-        lemma = [0, 0]
-        detailed = [0, 0]
-        simple = [0, 0]
-        lemma_values = dict()
-        detailed_values = dict()
-        simple_values = dict()
-        for token in results:
-            for element in results[token]["results"]:
-                if results[token]["results"][element]:
-                    eval(element)[0] += 1
-                else:
-                    eval(element)[1] += 1
-                    self.token_differences[token] = results[token]
-
-                values = eval(f'{element}_values')
-                for annotator in ("a", "b"):
-                    if results[token][annotator][element] not in values:
-                        values[results[token][annotator][element]] = dict()
-                        values[results[token][annotator][element]]["a"] = 0
-                        values[results[token][annotator][element]]["b"] = 0
-                        values[results[token][annotator][element]][annotator] += 1
-                    else:
-                        values[results[token][annotator][element]][annotator] += 1
-
-        # # megegyezés elvárható értéke
-        all = len(results)
-        po_lemma = lemma[0]/all
-        po_detailed = detailed[0]/all
-        po_simple = simple[0]/all
-
-        # Egyes kategória értékekhez (pl.: simple [/N][Nom]) tartozó p-k megállapítása
-        for data_dict in (lemma_values, detailed_values, simple_values):
-            for value in data_dict:
-                a = data_dict[value]["a"]
-                b = data_dict[value]["b"]
-                p_value = (a/all) * (b/all)
-
-                data_dict[value] = {
-                    "a": a,
-                    "b": b,
-                    "p": p_value
-                }
-
-        # Véletlenszerű megegyezés értéke
-        pe_lemma = sum(lemma_values[p_lemma]["p"] for p_lemma in lemma_values)
-        pe_detailed = sum(detailed_values[p_detailed]["p"] for p_detailed in detailed_values)
-        pe_simple = sum(simple_values[p_simple]["p"] for p_simple in simple_values)
-
-        # Kappa értéke
-        k_lemma = (po_lemma - pe_lemma) / (1 - pe_lemma)
-        k_detailed = (po_detailed - pe_detailed) / (1 - pe_detailed)
-        k_simple = (po_simple - pe_simple) / (1 - pe_simple)
-
-        datas = 'Annotátorok közti megegyezés várható értéke:\n' \
-                f'p_o Lemma: {po_lemma}\n' \
-                f'p_o Detailed: {po_detailed}\n' \
-                f'p_o Simple: {po_simple}\n\n' \
-                'Annotátorok közti véletlenszerű megegyezés értéke:\n' \
-                f'p_e Lemma: {pe_lemma}\n' \
-                f'p_e Detailed: {pe_detailed}\n' \
-                f'p_e Simple: {pe_simple}\n\n' \
-                'Cohen-féle Kappa értéke:\n' \
-                f'k Lemma: {k_lemma}\n' \
-                f'k Detailed: {k_detailed}\n' \
-                f'k Simple: {k_simple}'
-        print(datas)
-
-    def list_differences(self, results):
+        tokens = list(results)
+        mismatches = np.zeros(len(tokens), dtype=bool)
+        self.tokens = tokens
+        self.labels = dict()
+        self.codebooks = dict()
+        self.codes = dict()
+        agreement = dict()
+        for element in CATEGORIES:
+            self.labels[element] = tuple([results[token][annotator][element] for token in tokens]
+                                         for annotator in ("a", "b"))
+            codebook = self.codebooks[element] = dict()
+            a, b = self.codes[element] = tuple(encode_labels(labels, codebook) for labels in self.labels[element])
+            mismatches |= a != b
+            agreement[element] = cohen_kappa(a, b, len(codebook))
+
+        for i in np.flatnonzero(mismatches):
+            self.token_differences[tokens[i]] = results[tokens[i]]
+
+        return agreement
+
+    def bootstrap(self, resamples=10000, seed=0, processes=1, confidence=0.95):
+        """
+            Mondatonkénti bootstrap konfidenciaintervallumok (lásd bootstrap_intervals); a mondatokat az 1es
+            annotátor fájlja alapján veszi (a csak a 2es annotátornál szereplő tokenekét a 2es fájljából).
+        """
+        sentence_of = sentence_numbers(self.annotator_file1)
+        if any(token not in sentence_of for token in self.tokens):
+            sentence_of = {**sentence_numbers(self.annotator_file2), **sentence_of}
+        sentences = np.array([sentence_of[token] for token in self.tokens], dtype=np.int64)
+        return bootstrap_intervals(self.codes, sentences, resamples, seed, processes, confidence)
+
+    def list_differences(self, results, output_file):
         """
             Kiírja a két annotátor munkájában talált összes különbséget a meghatározott fájl-ba.
             :param results: results from self.extract_results method
+            :param output_file: a kimeneti fájl
         """
         for result in results:
             for annotator in results[result]:
@@ -211,46 +676,400 @@ class AnnotatorAgreementCalculator:
                     if not attribute_matches:
                         self.token_differences[result] = results[result]
 
-        with open("annotator_differences.txt", "w", encoding="utf-8") as file:
+        with open(output_file, "w", encoding="utf-8") as file:
             for token in sorted(self.token_differences):
-                if "modified_a" in self.token_differences[token]:
-                    a = self.token_differences[token]["a"][0].text if self.token_differences[token]["a"] else None
-                    b = self.token_differences[token]["b"][0].text if self.token_differences[token]["b"] else None
-                    line = f'Token: {token} \tEltérő tokenek.\nAnnotátor 1: {a}\nAnnotátor 2: {b}'
-                    print(line, sep=", ", flush=True, file=file)
+                difference = self.token_differences[token]
+                if "modified_a" in difference:
+                    line = format_token_difference(token, difference["a"], difference["b"])
                 else:
-                    line = f'Token: {token} \tEltérő elemzés.\n' \
-                           f'Annotátor 1:\tana modified={self.token_differences[token]["a"]["ana_modified"]}\t' \
-                           f'(lemma: {self.token_differences[token]["a"]["lemma"]} | ' \
-                           f'detailed: {self.token_differences[token]["a"]["detailed"]} | ' \
-                           f'simple: {self.token_differences[token]["a"]["simple"]})\n' \
-                           f'Annotátor 2:\tana modified={self.token_differences[token]["b"]["ana_modified"]}\t' \
-                           f'(lemma: {self.token_differences[token]["b"]["lemma"]} | ' \
-                           f'detailed: {self.token_differences[token]["b"]["detailed"]} | ' \
-                           f'simple: {self.token_differences[token]["b"]["simple"]})'
-                    print(line, sep=", ", flush=True, file=file)
+                    line = format_analysis_difference(token, difference["a"], difference["b"])
+                print(line, sep=", ", flush=True, file=file)
                 file.write("\n")
 
     def parse_xml(self, file):
         """
-            XML fájl feldolgozása az ElementTree python library használatával.
+            XML fájl feldolgozása a gold_standard.tei olvasójával (egyetlen menetben).
             :param file: annotátor fájl
             :return: tokens = { token_id: token }
         """
-        tree = ET.parse(file)
-        root = tree.getroot()
-        tokens = dict()
-        for token in root.findall(".//token"):
-            token_id = token.attrib[self.id_attrib]
-            tokens[token_id] = token
+        return {token.id: token for token in iter_tokens(file)}
+
+
+def token_groups(tokens):
+    """
+        Csoportosítja egy annotátor dokumentum-sorrendű tokenjeit a token id száma szerint (t{N}, t{N}_2, ...).
+        A szétválasztott tokenek sorrendje a csoporton belül kötetlen.
+        :param tokens: az annotátor tokenjei, pl. iter_tokens(annotator_file), ami egyetlen menetben olvas
+        :return: (N, { token_id: token }) párok, N szerint növekvő sorrendben
+    """
+    group_number, group = None, dict()
+    for token in tokens:
+        match = TOKEN_ID.fullmatch(token.id or "")
+        if match is None:
+            raise ValueError(f"Érvénytelen token id: {token.id}")
+        number = int(match["number"])
+        if number != group_number:
+            if group_number is not None:
+                if number < group_number:
+                    raise ValueError(f"A token id-k nem növekvő sorrendűek: {token.id}")
+                yield group_number, group
+            group_number, group = number, dict()
+        group[token.id] = token
+    if group_number is not None:
+        yield group_number, group
+
+
+def merge_tokens(token_streams):
+    """
+        Az annotátorok tokenjeit párhuzamosan olvassa, és a token id-k alapján összefésüli (merge join).
+        Egyszerre csak az aktuális tokencsoportok vannak a memóriában.
+        :param token_streams: az egyes annotátorok tokenjei dokumentum-sorrendben (lásd token_groups)
+        :return: (token_id, (az egyes annotátorok tokenje, ...)) párok dokumentum-sorrendben;
+                 ha egy token valamelyik annotátornál nem szerepel, ott None
+    """
+    iterators = [token_groups(tokens) for tokens in token_streams]
+    groups = [next(iterator, None) for iterator in iterators]
+    while any(group is not None for group in groups):
+        number = min(group[0] for group in groups if group is not None)
+        current = [group[1] if group is not None and group[0] == number else dict() for group in groups]
+        for token in dict.fromkeys(token for tokens in current for token in tokens):
+            yield token, tuple(tokens.get(token) for tokens in current)
+        for i, iterator in enumerate(iterators):
+            if current[i]:
+                groups[i] = next(iterator, None)
+
+
+def compare_stream(annotator_file1, annotator_file2):
+    """
+        Streaming összevetés: a tokeneket az összefésülés sorrendjében, egyenként minősíti.
+        :return: (token_id, státusz, a, b) négyesek, ahol a státusz
+                 "token" (eltérő tokenek; a, b: a tokenek vagy None),
+                 "analysis" (eltérő elemzés) vagy "match" (egyező elemzés; a, b: analysis_answer)
+    """
+    for token, (token_a, token_b) in merge_tokens((iter_tokens(annotator_file1), iter_tokens(annotator_file2))):
+        if form_differs(token_a, token_b):
+            yield token, "token", token_a, token_b
+        else:
+            a = analysis_answer(token_a.correct)
+            b = analysis_answer(token_b.correct)
+            status = "match" if all(a[element] == b[element] for element in CATEGORIES) else "analysis"
+            yield token, status, a, b
+
+
+def stream_agreement(annotator_file1, annotator_file2, output_file):
+    """
+        A két annotátor streaming összevetése: a különbségek azonnal, dokumentum-sorrendben kerülnek
+        az output_file-ba, a megegyezéshez csak címkénkénti darabszámokat tart a memóriában.
+        :return: { kategória: (p_o, p_e, kappa) }, ugyanazok az értékek, mint AnnotatorAgreementCalculator-ral
+    """
+    all = 0
+    matches = Counter()
+    label_counts = {element: (Counter(), Counter()) for element in CATEGORIES}
+    with open(output_file, "w", encoding="utf-8") as file:
+        for token, status, a, b in compare_stream(annotator_file1, annotator_file2):
+            if status == "token":
+                print(format_token_difference(token, a, b), file=file)
+                file.write("\n")
+                continue
+            if status == "analysis":
+                print(format_analysis_difference(token, a, b), file=file)
+                file.write("\n")
+            all += 1
+            for element in CATEGORIES:
+                matches[element] += a[element] == b[element]
+                label_counts[element][0][a[element]] += 1
+                label_counts[element][1][b[element]] += 1
+
+    agreement = dict()
+    for element in CATEGORIES:
+        counts_a, counts_b = label_counts[element]
+        agreement[element] = kappa_from_counts(
+            all, matches[element], sum(count * counts_b[label] for label, count in counts_a.items()))
+    return agreement
+
+
+def token_offsets(tokens):
+    """
+        A tokenek szövege a szóalakokból és a join attribútumokból (a tokenek közti szóközökkel), és az egyes
+        tokenek végének karakterpozíciója benne.
+        :param tokens: egymást követő tokenek
+        :return: (szöveg, [végpozíciók])
+    """
+    text = ""
+    ends = []
+    for token, space in zip(tokens, spaces_from_joins([token.join for token in tokens])):
+        text += token.form
+        ends.append(len(text))
+        if space:
+            text += " "
+    return text.rstrip(" "), ends
+
+
+def align_stretch(tokens_a, tokens_b):
+    """
+        Két annotátor két horgony közti (eltérő) tokenjeinek illesztése. Ha a szakasz szövege azonos, ott
+        vágja szét, ahol mindkét annotátornál token vége van (a szétválasztott / összevont tokenek így egy
+        egységbe kerülnek); ha a szöveg is eltér (pl. javított elírás), azonos tokenszámnál sorban párosít,
+        különben a szakasz egyetlen egység.
+        :return: (1es annotátor tokenjei, 2es annotátor tokenjei) egységek
+    """
+    text_a, ends_a = token_offsets(tokens_a)
+    text_b, ends_b = token_offsets(tokens_b)
+    if text_a != text_b:
+        if len(tokens_a) == len(tokens_b):
+            yield from (([token_a], [token_b]) for token_a, token_b in zip(tokens_a, tokens_b))
+        else:
+            yield tokens_a, tokens_b
+        return
+
+    start_a = start_b = i = k = 0
+    while i < len(ends_a) and k < len(ends_b):
+        if ends_a[i] == ends_b[k]:
+            yield tokens_a[start_a:i + 1], tokens_b[start_b:k + 1]
+            start_a, start_b = i + 1, k + 1
+            i, k = start_a, start_b
+        elif ends_a[i] < ends_b[k]:
+            i += 1
+        else:
+            k += 1
+    if start_a < len(tokens_a) or start_b < len(tokens_b):
+        # Pl. üres szóalakok a szakasz végén
+        yield tokens_a[start_a:], tokens_b[start_b:]
+
+
+def align_tokens(tokens_a, tokens_b):
+    """
+        Két annotátor tokenjeinek illesztése lineáris időben. A token id-k szerinti összefésülésben (merge_tokens)
+        horgonyok azok a tokenek, amelyek mindkét annotátornál azonos id-vel és szóalakkal szerepelnek;
+        a köztük lévő szakaszokat align_stretch illeszti karakterpozíciók alapján.
+        :param tokens_a: az 1es annotátor tokenjei dokumentum-sorrendben
+        :param tokens_b: a 2es annotátor tokenjei dokumentum-sorrendben
+        :return: (1es annotátor tokenjei, 2es annotátor tokenjei) egységek dokumentum-sorrendben; az egyik
+                 oldal üres, ha a tokent csak az egyik annotátor vette fel
+    """
+    stretch_a, stretch_b = [], []
+    for _, (token_a, token_b) in merge_tokens((tokens_a, tokens_b)):
+        if token_a is not None and token_b is not None and token_a.form == token_b.form:
+            if stretch_a or stretch_b:
+                yield from align_stretch(stretch_a, stretch_b)
+                stretch_a, stretch_b = [], []
+            yield [token_a], [token_b]
+        else:
+            if token_a is not None:
+                stretch_a.append(token_a)
+            if token_b is not None:
+                stretch_b.append(token_b)
+    if stretch_a or stretch_b:
+        yield from align_stretch(stretch_a, stretch_b)
+
+
+def unit_answer(tokens):
+    """
+        Egy annotátor válasza egy illesztett egységre: egy token esetén a helyes elemzése, több token esetén
+        az elemzések '+'-szal összefűzve (így csak az azonos tokenizálású és elemzésű egységek egyeznek).
+        :param tokens: az egység tokenjei (lehet üres); a helyes elemzés nélküli tokenek címkéje NO_ANALYSIS,
+                       így az ilyen tokent tartalmazó egység a különbségek közé kerül
+        :return: { form, lemma, detailed, simple, ana_modified }
+    """
+    answers = [analysis_answer(token.correct) for token in tokens]
+    answer = {element: "+".join(answer[element] for answer in answers) for element in CATEGORIES}
+    answer["ana_modified"] = any(answer["ana_modified"] for answer in answers)
+    answer["form"] = " ".join(token.form for token in tokens)
+    return answer
+
+
+class AlignedAgreementCalculator(AnnotatorAgreementCalculator):
+    """
+        Mint az AnnotatorAgreementCalculator, de a módosított szóalakú és az eltérően tokenizált tokeneket nem
+        hagyja ki: a két annotátor tokenjeit illeszti (align_tokens), és minden illesztett egységet (tokent,
+        ill. szétválasztott / összevont szakaszt) összevet. Az eltérő szóalakú egységek a különbségek közé
+        is bekerülnek.
+    """
+    def create_token_objects(self, a, b):
+        """
+            Illeszti az A és B annotátor tokenjeit; az egységek az első tokenjük id-jét kapják.
+            :param a: 1es annotátor tokenek (dokumentum-sorrendben)
+            :param b: 2es annotátor tokenek (dokumentum-sorrendben)
+            :return: token_objects = { egység id: { a: tokenek a, b: tokenek b } }
+        """
+        token_objects = dict()
+        for tokens_a, tokens_b in align_tokens(a.values(), b.values()):
+            token_objects[(tokens_a or tokens_b)[0].id] = {"a": tokens_a, "b": tokens_b}
+        return token_objects
+
+    def extract_results(self, token_objects):
+        """
+            Kinyeri az annotátorok egyes egységekre adott válaszait (unit_answer), és jelöli az egyezésüket.
+            :param token_objects: token_objects dictionary from self.create_token_objects method
+            :return: answers = { egység id: a, b, results }
+        """
+        answers = dict()
+        for token in token_objects:
+            a = unit_answer(token_objects[token]["a"])
+            b = unit_answer(token_objects[token]["b"])
+            answers[token] = {
+                "a": a,
+                "b": b,
+                "results": {element: a[element] == b[element] for element in CATEGORIES}
+            }
+            if a["form"] != b["form"]:
+                self.token_differences[token] = answers[token]
+        return answers
+
 
-        return tokens
+def multi_agreement(annotator_files, output_file):
+    """
+        Több annotátor összevetése: a fájlok összefésülésével egyszer felépíti a token × annotátor
+        címkemátrixot, és kategóriánként kiszámolja a Fleiss-féle kappát és a Krippendorff-féle alfát.
+        Csak azok a tokenek számítanak, amelyek minden annotátornál megvannak azonos szóalakkal; az eltérő
+        tokenek és elemzések dokumentum-sorrendben kerülnek az output_file-ba.
+        :param annotator_files: annotátor fájlok
+        :param output_file: a különbségek fájlja
+        :return: ({ kategória: (p_o, p_e, kappa, alfa) }, összevetett tokenek száma)
+    """
+    labels = {element: [] for element in CATEGORIES}
+    with open(output_file, "w", encoding="utf-8") as file:
+        for token, tokens in merge_tokens([iter_tokens(annotator_file) for annotator_file in annotator_files]):
+            if None in tokens or len({form_key(annotator_token) for annotator_token in tokens}) > 1:
+                print(format_token_difference(token, *tokens), file=file)
+                file.write("\n")
+                continue
+            answers = [analysis_answer(annotator_token.correct) for annotator_token in tokens]
+            if any(answer[element] != answers[0][element] for answer in answers for element in CATEGORIES):
+                print(format_analysis_difference(token, *answers), file=file)
+                file.write("\n")
+            for element in CATEGORIES:
+                labels[element].extend(answer[element] for answer in answers)
+
+    agreement = dict()
+    for element in CATEGORIES:
+        codebook = dict()
+        codes = encode_labels(labels[element], codebook).reshape(-1, len(annotator_files))
+        agreement[element] = (*fleiss_kappa(codes, len(codebook)), krippendorff_alpha(codes, len(codebook)))
+    return agreement, len(codes)
+
+
+def annotator_pairs(corpus_dir):
+    """
+        Megkeresi a korpusz többszörösen annotált dokumentumait (a {dokumentum}_annotN.xml fájlok csoportjait).
+        :param corpus_dir: a korpusz könyvtára
+        :return: [ (műfaj, dokumentum, annotátor fájl 1, annotátor fájl 2) ], minden annotátor-párra
+    """
+    groups = defaultdict(list)
+    for xml_file in corpus_files(corpus_dir):
+        if match := ANNOTATOR_FILE.fullmatch(xml_file.stem):
+            groups[genre(xml_file), match["document"]].append((int(match["annotator"]), xml_file))
+    return [(genre_name, document, file1, file2)
+            for (genre_name, document), files in sorted(groups.items())
+            for (_, file1), (_, file2) in combinations(sorted(files), 2)]
+
+
+def compare_pair(annotator_file1, annotator_file2, output_file, align=False):
+    """
+        Egy annotátor-pár összevetése (a kötegelt mód folyamataiban fut).
+        :param align: az illesztett egységeket veti össze (AlignedAgreementCalculator)
+        :return: az annotátorok címkéi: { kategória: (címkék a, címkék b) }
+    """
+    calculator = AlignedAgreementCalculator if align else AnnotatorAgreementCalculator
+    aac = calculator(annotator_file1, annotator_file2, output_file, verbose=False)
+    return aac.labels
+
+
+def corpus_agreement(corpus_dir, output_dir, processes=1, confusion=None, output_format="json", align=False):
+    """
+        Kötegelt mód: a korpusz összes annotátor-párjának összevetése egy process pool-ban. A különbségek
+        páronként egy fájlba kerülnek az output_dir könyvtárban ({dokumentum}_annotN-annotM.txt).
+        A címkék kategóriánként közös kódolást kapnak, így a megegyezés a dokumentumok, a műfajok és az
+        összes pár egyesített címkéin is kiszámolható.
+        :param corpus_dir: a korpusz könyvtára
+        :param output_dir: a különbségek könyvtára
+        :param processes: a párhuzamos folyamatok száma
+        :param confusion: ha meg van adva, a táblázatok (agreement_tables) előtagja minden sorhoz
+        :param output_format: a táblázatok formátuma (write_tables)
+        :param align: az illesztett egységeket veti össze (AlignedAgreementCalculator)
+        :return: [ (szint, név, párok száma, tokenek száma, { kategória: (p_o, p_e, kappa) }) ]
+    """
+    pairs = annotator_pairs(corpus_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_files = [output_dir / f'{file1.stem}-{file2.stem.rsplit("_", 1)[1]}.txt'
+                    for _, _, file1, file2 in pairs]
+    args = ([file1 for _, _, file1, _ in pairs], [file2 for _, _, _, file2 in pairs], output_files,
+            [align] * len(pairs))
+
+    if processes == 1:
+        pair_labels = list(map(compare_pair, *args))
+    else:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as executor:
+            pair_labels = list(executor.map(compare_pair, *args))
+
+    codebooks = {element: dict() for element in CATEGORIES}
+    pair_codes = [{element: tuple(encode_labels(values, codebooks[element]) for values in labels[element])
+                   for element in CATEGORIES}
+                  for labels in pair_labels]
+
+    groups = {level: defaultdict(list) for level in ("document", "genre", "all")}
+    for (genre_name, document, _, _), codes in zip(pairs, pair_codes):
+        groups["document"][document].append(codes)
+        groups["genre"][genre_name].append(codes)
+        groups["all"]["all"].append(codes)
+
+    report = []
+    table_groups = []
+    for level, level_groups in groups.items():
+        for name, group in level_groups.items():
+            agreement = dict()
+            group_codes = dict()
+            for element in CATEGORIES:
+                a, b = group_codes[element] = tuple(np.concatenate([codes[element][i] for codes in group])
+                                                    for i in (0, 1))
+                agreement[element] = cohen_kappa(a, b, len(codebooks[element]))
+            report.append((level, name, len(group), len(a), agreement))
+            table_groups.append((level, name, group_codes))
+    if confusion is not None:
+        write_tables(agreement_tables(table_groups, codebooks), confusion, output_format)
+    return report
+
+
+def print_report(report, file=sys.stdout):
+    """
+        A kötegelt mód eredménye TSV formában.
+        :param report: corpus_agreement kimenete
+    """
+    print("level", "name", "pairs", "tokens",
+          *(f"{value}_{element}" for element in CATEGORIES for value in ("p_o", "p_e", "kappa")),
+          sep="\t", file=file)
+    for level, name, num_pairs, num_tokens, agreement in report:
+        print(level, name, num_pairs, num_tokens,
+              *(f"{value:.6f}" for element in CATEGORIES for value in agreement[element]),
+              sep="\t", file=file)
 
 
 if __name__ == '__main__':
-    annotator_files = parse_user_input()
+    options = parse_user_input()
 
-    aac = AnnotatorAgreementCalculator(
-        annotator_file1=annotator_files[0],
-        annotator_file2=annotator_files[1]
-    ) 
+    if options.corpus_dir is not None:
+        print_report(corpus_agreement(options.corpus_dir, options.output or Path("annotator_differences"),
+                                      options.processes, options.confusion, options.format, options.align))
+    elif len(options.target_files) > 2 or options.multi:
+        agreement, num_tokens = multi_agreement(options.target_files, options.output or "annotator_differences.txt")
+        print(format_multi_agreement(agreement, len(options.target_files), num_tokens))
+        if num_tokens == 0:
+            sys.exit(1)
+    elif options.stream:
+        print(format_agreement(stream_agreement(options.target_files[0], options.target_files[1],
+                                                options.output or "annotator_differences.txt")))
+    else:
+        calculator = AlignedAgreementCalculator if options.align else AnnotatorAgreementCalculator
+        aac = calculator(
+            annotator_file1=options.target_files[0],
+            annotator_file2=options.target_files[1],
+            output_file=options.output or "annotator_differences.txt"
+        )
+        if options.confusion is not None:
+            name = f'{Path(options.target_files[0]).stem}-{Path(options.target_files[1]).stem}'
+            write_tables(agreement_tables([("pair", name, aac.codes)], aac.codebooks), options.confusion,
+                         options.format)
+        if options.bootstrap is not None:
+            intervals = aac.bootstrap(options.bootstrap, options.seed, options.processes, options.confidence)
+            print()
+            print(format_intervals(intervals, options.bootstrap, options.confidence, options.seed))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Measures how long the XML parsing done by the corpus scripts takes with the
+stdlib and the lxml backend (see gold_standard.backend), and compares both
+to the baseline: the whole-file ElementTree.parse + findall code the scripts
+used before the streaming reader. Each measurement runs in a separate
+process, as the backend is selected on import.
+"""
+
+from argparse import ArgumentParser
+from itertools import pairwise
+import os
+from pathlib import Path
+import subprocess
+import sys
+from time import perf_counter
+from xml.etree import ElementTree
+
+from gold_standard.backend import fromstring
+from gold_standard.tei import sentences
+
+
+# The parsing done by each script; the functions take a list of files
+def _tei_sentences(files):
+    for file in files:
+        for _ in sentences(file):
+            pass
+
+
+def _validation(files):
+    from gold_standard.validation import validate_file
+    for file in files:
+        for _ in validate_file(file):
+            pass
+
+
+def _annotator_agreement(files):
+    from annotator_agreement import AnnotatorAgreementCalculator
+    # The constructor does the whole comparison; we only need the parsing
+    calculator = object.__new__(AnnotatorAgreementCalculator)
+    for file in files:
+        calculator.parse_xml(file)
+
+
+def _fromstring(files):
+    # What fix_encoding.parse_xml and
+    # create_annotation_input_from_eltec.get_cleaned_teixml do
+    for file in files:
+        fromstring(file.read_bytes())
+
+
+TASKS = {
+    'tei.sentences': _tei_sentences,
+    'validation.validate_file': _validation,
+    'annotator_agreement.parse_xml': _annotator_agreement,
+    'fix_encoding / eltec fromstring': _fromstring,
+}
+BACKENDS = ('stdlib', 'lxml')
+
+
+# The same work done the old way: the whole file is parsed with ElementTree
+# and the records are built from findall()s, regardless of the backend
+_XML_ID = '{http://www.w3.org/XML/1998/namespace}id'
+
+
+def _stripped(elem) -> str:
+    return '' if elem is None or elem.text is None else elem.text.strip()
+
+
+def _baseline_tei_sentences(files):
+    for file in files:
+        root = ElementTree.fromstring(file.read_text(encoding='utf-8'))
+        for p_tag in root.iterfind('.//text//p'):
+            for s_tag in p_tag.iterfind('.//s'):
+                tokens = [(t_tag.find('form').text.strip(), t_tag.get(_XML_ID))
+                          for t_tag in s_tag.iterfind('.//token')]
+                if tokens:
+                    words, ids = zip(*tokens)
+                    ' '.join(words)
+
+
+def _baseline_validation(files):
+    # What check_joins.parse_tei and validate_joins did
+    left, right = {'left', 'both'}, {'right', 'both'}
+    for file in files:
+        root = ElementTree.parse(file).getroot()
+        for p_tag in root.find('.//text').findall('.//p'):
+            for s_tag in p_tag.findall('./s'):
+                tokens = []
+                for t_tag in s_tag.findall('./token'):
+                    for ana in t_tag.find('morph').findall('ana'):
+                        if ana.get('correct') == 'True':
+                            break
+                    tokens.append({'form': _stripped(t_tag.find('form')),
+                                   'join': t_tag.attrib['join'],
+                                   'lemma': _stripped(ana.find('lemma')),
+                                   'detailed': _stripped(ana.find('detailed')),
+                                   'simple': _stripped(ana.find('simple')),
+                                   'id': t_tag.attrib[_XML_ID]})
+                for prev, token in pairwise(tokens):
+                    (prev['join'] in right) != (token['join'] in left)
+
+
+def _baseline_annotator_agreement(files):
+    for file in files:
+        {token.attrib[_XML_ID]: token
+         for token in ElementTree.parse(file).getroot().findall('.//token')}
+
+
+def _baseline_fromstring(files):
+    for file in files:
+        ElementTree.fromstring(file.read_bytes())
+
+
+BASELINES = {
+    'tei.sentences': _baseline_tei_sentences,
+    'validation.validate_file': _baseline_validation,
+    'annotator_agreement.parse_xml': _baseline_annotator_agreement,
+    'fix_encoding / eltec fromstring': _baseline_fromstring,
+}
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('corpus_dir', type=Path, nargs='?',
+                        default=Path(__file__).parent.parent / 'corpus' / 'Morph annotated',
+                        help='the directory of the XML files (the Morph '
+                             'annotated corpus).')
+    parser.add_argument('--repeat', '-r', type=int, default=1,
+                        help='the number of runs per task and backend; the '
+                             'best time is reported (default: 1).')
+    parser.add_argument('--task', '-t', action='append', choices=TASKS,
+                        help='the task(s) to run (default: all).')
+    parser.add_argument('--worker', choices=TASKS, help='internal use.')
+    parser.add_argument('--baseline', action='store_true',
+                        help='internal use.')
+    return parser.parse_args()
+
+
+def run_worker(task: str, corpus_dir: Path, baseline: bool = False):
+    """Runs a single task (or its baseline) and prints the elapsed time."""
+    sys.path.insert(0, str(Path(__file__).parent))
+    files = sorted(corpus_dir.glob('**/*.xml'))
+    start = perf_counter()
+    (BASELINES if baseline else TASKS)[task](files)
+    print(perf_counter() - start)
+
+
+def measure(task: str, backend: str | None, corpus_dir: Path) -> float:
+    """
+    Runs a task in a subprocess with _backend_ and returns its time. If
+    _backend_ is ``None``, the baseline of the task is run instead.
+    """
+    env = dict(os.environ, GOLD_STANDARD_XML_BACKEND=backend or 'stdlib')
+    command = [sys.executable, __file__, str(corpus_dir), '--worker', task]
+    if backend is None:
+        command.append('--baseline')
+    result = subprocess.run(command, env=env, capture_output=True, text=True,
+                            check=True)
+    return float(result.stdout)
+
+
+def main():
+    args = parse_arguments()
+    if args.worker:
+        run_worker(args.worker, args.corpus_dir, args.baseline)
+        return
+
+    try:
+        import lxml  # noqa
+    except ImportError:
+        print('lxml is not installed; nothing to compare.', file=sys.stderr)
+        sys.exit(1)
+
+    # The speedups are relative to the baseline; below 1x is a slowdown
+    print('task', 'baseline', *BACKENDS, *(f'{b} speedup' for b in BACKENDS),
+          sep='\t')
+    totals = [0.0] * (len(BACKENDS) + 1)
+    for task in args.task or TASKS:
+        times = [min(measure(task, backend, args.corpus_dir)
+                     for _ in range(args.repeat))
+                 for backend in (None, *BACKENDS)]
+        totals = [total + t for total, t in zip(totals, times)]
+        print_row(task, times)
+    print_row('total', totals)
+
+
+def print_row(name: str, times: list[float]):
+    """Prints the baseline and backend _times_ and the speedups."""
+    print(name, *(f'{t:.2f}s' for t in times),
+          *(f'{times[0] / t:.2f}x' for t in times[1:]), sep='\t', flush=True)
+
+
+if __name__ == '__main__':
+    main()
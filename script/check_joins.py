@@ -1,138 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Validates the gold standard TEI XML files with the rules in
+gold_standard.validation (join consistency, ids, analyses, etc.), running
+all of them in a single pass per file. The files (or the XML files under
+the directories) given are validated in parallel; the issues are printed in
+a stable order (by file, then in document order) and can be written to a
+JSON or TSV report. The exit status is 1 if any error is found, so the
+script can be used as a gate.
+
+The results are cached by the git blob hash of the files, so only new or
+changed files are parsed again. With --changed, only the files that differ
+from a git revision (or are untracked) are checked, e.g. in a pre-commit
+hook.
+"""
+
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import json
+import multiprocessing
+import os
+import sys
 from pathlib import Path
-from itertools import pairwise
-from typing import Iterator, Any
-from xml.etree import ElementTree
-
-XML_NS = '{http://www.w3.org/XML/1998/namespace}'
-
-LEFT = {'left', 'both'}
-RIGHT = {'right', 'both'}
-
-
-def validate_joins(tokens):
-    # Boundary checks
-    if tokens[0]['join'] in LEFT:
-        yield f'Token ({tokens[0]["id"]}) \'{tokens[0]["form"]}\'' \
-              f' requires a left join ({tokens[0]["join"]}) but has no left neighbour'
-
-    if tokens[-1]['join'] in RIGHT:
-        yield f'Token ({tokens[-1]["id"]}) \'{tokens[-1]["form"]}\'' \
-              f' requires a right join ({tokens[-1]["join"]}) but has no right neighbour'
-
-    # Check every adjacent pair
-    for left, right in pairwise(tokens):
-        left_wants_right = left['join'] in RIGHT
-        right_wants_left = right['join'] in LEFT
-
-        if left_wants_right != right_wants_left:
-            if left_wants_right:
-                yield f'Token ({left["id"]}) \'{left["form"]}\' wants to join right ({left["join"]}),' \
-                      f' but \'{right["form"]}\' does not accept a left join ({right["join"]})'
-            else:
-                yield f'Token ({right["id"]}) \'{right["form"]}\' wants to join left ({right["join"]}),' \
-                      f' but \'{left["form"]}\' does not accept a right join ({left["join"]})'
-
-
-def none_or_text_none_or_empty(element):
-    if element is None or element.text is None:
-        return True
-
-    return len(element.text.strip()) == 0
-
-
-def stripped_text_or_empty(element):
-    if element is None or element.text is None:
-        return ''
-
-    return element.text.strip()
-
-
-def parse_tei(filename) -> Iterator[dict[str, Any]]:
+from typing import NamedTuple
+
+from gold_standard.cache import cache_dir, corpus_files
+from gold_standard.git import blob_hash, changed_files
+from gold_standard.validation import ERROR, RULES, WARNING, Issue, ResultCache, validate_file
+
+
+DEFAULT_CORPUS_DIR = Path(__file__).parent.parent / 'corpus' / 'Morph annotated'
+REPORT_FORMATS = ('json', 'tsv')
+
+
+class FileReport(NamedTuple):
+    """The result of validating a file."""
+    file: str
+    issues: list[Issue]
+
+    def count(self, severity: str) -> int:
+        return sum(1 for issue in self.issues if issue.severity == severity)
+
+
+def input_files(paths: list[Path]) -> list[Path]:
+    """
+    The files in _paths_ and the XML files under the directories in _paths_,
+    in the order given (directories sorted), without duplicates.
+    """
+    files = {}
+    for path in paths:
+        for file in corpus_files(path) if path.is_dir() else [path]:
+            files.setdefault(file.resolve(), file)
+    return list(files.values())
+
+
+def check_file(xml_file: Path, rule_names: list[str] | None = None) -> FileReport:
+    """Validates _xml_file_ with the rules in _rule_names_ (default: all)."""
+    return FileReport(str(xml_file), list(validate_file(xml_file, rule_names)))
+
+
+def _check_files(files: list[Path], rule_names: list[str] | None,
+                 processes: int) -> Iterator[FileReport]:
+    check = partial(check_file, rule_names=rule_names)
+    if processes == 1 or len(files) <= 1:
+        yield from map(check, files)
+    else:
+        with ProcessPoolExecutor(processes,
+                                 mp_context=multiprocessing.get_context('fork')) as executor:
+            # Small chunks, as the files vary in size a lot
+            yield from executor.map(check, files,
+                                    chunksize=max(1, len(files) // (8 * processes)))
+
+
+def check_files(files: list[Path], rule_names: list[str] | None = None,
+                processes: int = 1, cache: ResultCache | None = None) -> Iterator[FileReport]:
+    """
+    Validates _files_ with _processes_ worker processes. The reports are
+    yielded in the order of _files_, regardless of _processes_.
+
+    :param cache: the results of the files whose contents are in the cache
+                  are taken from there; those of the rest are added to it.
+    """
+    if cache is None:
+        yield from _check_files(files, rule_names, processes)
+        return
+
+    blobs, cached = [], {}
+    for file in files:
+        try:
+            blob = blob_hash(file)
+        except OSError:
+            # Reported by check_file
+            blob = None
+        blobs.append(blob)
+        if blob is not None and (issues := cache.get(blob)) is not None:
+            cached[file] = issues
+
+    checked = _check_files([file for file in files if file not in cached],
+                           rule_names, processes)
     try:
-        tree = ElementTree.parse(filename)
-    except ElementTree.ParseError:
-        print(filename)
-        raise
-    root = tree.getroot()
-
-    text = root.find('.//text')
-    if text is None:
-        raise NotImplementedError('Text tag not found!')
-
-    # Paragraphs
-    paragraphs = text.findall('.//p')
-    if len(paragraphs) == 0:
-        raise NotImplementedError('No paragraph found!')
-
-    for p in paragraphs:
-        sentences = p.findall('./s')
-        if len(sentences) == 0:
-            raise NotImplementedError('Empty paragraph!')
-        for s in sentences:
-            out_sentence = {'id': s.attrib[XML_NS + 'id'], 'tokens': []}
-
-            try:
-                tokens = s.findall('./token')
-                if len(tokens) == 0:
-                    raise NotImplementedError('Empty sentence!')
-                for tok in tokens:
-                    form = tok.find('form')
-                    if none_or_text_none_or_empty(form):
-                        raise NotImplementedError('Empty form!')
-
-                    morph = tok.find('morph')
-                    if morph is None:
-                        raise NotImplementedError('No morph tag found!')
-                    anas = morph.findall('ana')
-                    if len(anas) == 0:
-                        raise NotImplementedError('Empy ana!')
-
-                    for ana in anas:
-                        if ana.attrib.get('correct') != 'True':
-                            continue
-
-                        lemma = ana.find('lemma')
-                        detailed = ana.find('detailed')
-                        simple = ana.find('simple')
-
-                        if none_or_text_none_or_empty(lemma) or none_or_text_none_or_empty(simple):
-                            raise NotImplementedError('Missing analyse field!')
-
-                        lemma_val = stripped_text_or_empty(lemma)
-                        detailed_val = stripped_text_or_empty(detailed)
-                        simple_val = stripped_text_or_empty(simple)
-                        break
-                    else:
-                        raise NotImplementedError('No correct ana!')
-
-                    join_attr = tok.attrib['join']
-                    if join_attr not in {'left', 'right', 'both', 'no'}:
-                        raise ValueError('Join has incorrect value!')
-
-                    token = {'form': stripped_text_or_empty(form), 'join': join_attr, 'lemma': lemma_val,
-                             'detailed': detailed_val, 'simple': simple_val, 'id': tok.attrib[XML_NS + 'id']}
-
-                    out_sentence['tokens'].append(token)
-            except NotImplementedError:
-                continue
-
-            yield out_sentence
-
-
-def iter_xml_files(directory):
-    directory = Path(directory)
-
-    if not directory.is_dir():
-        raise NotADirectoryError(directory)
-
-    yield from sorted(directory.glob('**/*.xml'))
+        for file, blob in zip(files, blobs):
+            if file in cached:
+                yield FileReport(str(file), cached[file])
+            else:
+                report = next(checked)
+                if blob is not None:
+                    cache.put(blob, report.issues)
+                yield report
+    finally:
+        # The results so far are kept even if the run is interrupted
+        cache.flush()
+
+
+def write_report(reports: list[FileReport], report_file: Path, report_format: str):
+    """
+    Writes _reports_ to _report_file_. The JSON report lists every file
+    checked with its issues; the TSV report has a row per issue.
+    """
+    with open(report_file, 'w', encoding='utf-8') as outf:
+        if report_format == 'json':
+            json.dump({
+                'files': len(reports),
+                'errors': sum(report.count(ERROR) for report in reports),
+                'warnings': sum(report.count(WARNING) for report in reports),
+                'reports': [{'file': report.file,
+                             'issues': [issue._asdict() for issue in report.issues]}
+                            for report in reports],
+            }, outf, ensure_ascii=False, indent=2)
+            outf.write('\n')
+        else:
+            print('file', *Issue._fields, sep='\t', file=outf)
+            for report in reports:
+                for issue in report.issues:
+                    print(report.file, *(value or '' for value in issue),
+                          sep='\t', file=outf)
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('paths', type=Path, nargs='*', default=[DEFAULT_CORPUS_DIR],
+                        help='the XML files and directories to check '
+                             '(default: the Morph annotated corpus).')
+    parser.add_argument('--rules', '-R', nargs='+', choices=list(RULES),
+                        metavar='RULE',
+                        help='the rules to run (default: all; {}).'.format(
+                            ', '.join(RULES)))
+    parser.add_argument('--changed', '-c', nargs='?', const='HEAD', metavar='REF',
+                        help='only check the files that differ from the git '
+                             'revision REF in the working tree (staged or not) '
+                             'or are untracked (default REF: HEAD).')
+    parser.add_argument('--cache', type=Path,
+                        help='the file where the results are cached by the '
+                             'git blob hash of the files (default: '
+                             'validation.jsonl in the cache directory of the '
+                             'Morph annotated corpus).')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the cache.')
+    parser.add_argument('--report', '-r', type=Path,
+                        help='write the issues to this file.')
+    parser.add_argument('--format', '-f', choices=REPORT_FORMATS,
+                        help='the format of the report (default: from the '
+                             'extension of the report file, otherwise tsv).')
+    parser.add_argument('--quiet', '-q', action='store_true',
+                        help='do not print the issues, only the summary.')
+    parser.add_argument('--strict', action='store_true',
+                        help='fail on warnings too.')
+    parser.add_argument('--processes', '-P', type=int, default=1,
+                        help='number of worker processes to use (max is the '
+                             'num of cores, default: 1)')
+    args = parser.parse_args()
+
+    num_procs = len(os.sched_getaffinity(0))
+    if args.processes < 1 or args.processes > num_procs:
+        parser.error('Number of processes must be between 1 and {}'.format(
+            num_procs))
+    for path in args.paths:
+        if not path.exists():
+            parser.error(f'{path} does not exist.')
+    if args.no_cache:
+        args.cache = None
+    elif args.cache is None:
+        args.cache = cache_dir(DEFAULT_CORPUS_DIR) / 'validation.jsonl'
+    if args.format is None and args.report is not None:
+        suffix = args.report.suffix.lstrip('.').lower()
+        args.format = suffix if suffix in REPORT_FORMATS else 'tsv'
+    return args
+
+
+def main():
+    args = parse_arguments()
+    files = input_files(args.paths)
+    if args.changed is not None:
+        try:
+            changed = changed_files(args.paths, args.changed)
+        except RuntimeError as e:
+            sys.exit(f'Cannot list the changed files: {e}')
+        files = [file for file in files if file.resolve() in changed]
+    cache = ResultCache(args.cache, args.rules) if args.cache is not None else None
+    reports = []
+    for report in check_files(files, args.rules, args.processes, cache):
+        reports.append(report)
+        if not args.quiet:
+            for issue in report.issues:
+                print(report.file, *(value or '-' for value in issue), sep='\t')
+    if args.report is not None:
+        write_report(reports, args.report, args.format)
+
+    num_errors = sum(report.count(ERROR) for report in reports)
+    num_warnings = sum(report.count(WARNING) for report in reports)
+    num_bad_files = sum(1 for report in reports if report.issues)
+    print(f'{num_errors} errors and {num_warnings} warnings in {num_bad_files}'
+          f' of {len(reports)} files', file=sys.stderr)
+    sys.exit(1 if num_errors > 0 or args.strict and num_warnings > 0 else 0)
 
 
 if __name__ == '__main__':
-    for xml_file in iter_xml_files('../corpus/Morph annotated'):
-        sents = parse_tei(xml_file)
-        for sent in sents:
-            sent_tokens: list[dict] = sent['tokens']
-            for err in validate_joins(sent_tokens):
-                print(xml_file, sent['id'], err)
-                print(*(tok['form'] for tok in sent['tokens']))
+    main()
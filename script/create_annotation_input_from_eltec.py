@@ -18,13 +18,13 @@ from glob import glob
 from json import loads
 import csv
 import ast
-from xml.etree import ElementTree
 from xml.dom import minidom
 from datetime import date, datetime
 from emtsv import build_pipeline, jnius_config, tools, presets, singleton_store_factory
 
+from gold_standard.backend import XML_ID, etree as ElementTree, fromstring
+
 jnius_config.classpath_show_warning = False  # To suppress warning
-ElementTree.register_namespace("", "http://www.tei-c.org/ns/1.0")
 singletons = singleton_store_factory()
 
 TEI_NAMESPACE = {"ns": "http://www.tei-c.org/ns/1.0"}
@@ -61,7 +61,7 @@ def get_cleaned_teixml(teixml):
     text = text.replace("­", "")  # Ez nem normál kötőjel, hanem soft hyphen, amiket ki kell szedni.
     text = text.replace("\n", "")  # A level1-ben vannak sorvég karakterek, ezeket is ki kell szedni.
     text = text.replace('xmlns="http://www.tei-c.org/ns/1.0" ', "")
-    root = ElementTree.fromstring(text)
+    root = fromstring(text)
     root = remove_empty_p_tags(root)
     # Unwrap <hi> tags
     for p_tag in root.iterfind(".//hi/.."):
@@ -178,7 +178,7 @@ def create_xmlid(root, tag_names=None):
         tag_names = ("div", "p", "s", "token")
     for tag_name in tag_names:
         for tag_id, tag in enumerate(root.iterfind(f".//text//{tag_name}", TEI_NAMESPACE), start=1):
-            tag.set("xml:id", f"{tag_name[0]}{tag_id}")
+            tag.set(XML_ID, f"{tag_name[0]}{tag_id}")
     return root
 
 
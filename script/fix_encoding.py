@@ -7,13 +7,14 @@ import sys
 import difflib
 import unicodedata
 from pathlib import Path
-from xml.etree import ElementTree
 from contextlib import contextmanager
 from tempfile import NamedTemporaryFile
 from logging import getLogger, Logger, StreamHandler, Formatter, INFO, CRITICAL, DEBUG
 
 from git import Repo
 
+from gold_standard.backend import ParseError, fromstring
+
 SHOW_FIX_DETAILS = False  # Switch temorarily between INFO and DEBUG at the core fixing part
 
 
@@ -135,9 +136,9 @@ class GitHistory:
 
 def parse_xml(text):
     try:
-        ElementTree.fromstring(text)
+        fromstring(text)
         return True, None
-    except ElementTree.ParseError as e:
+    except ParseError as e:
         return False, str(e)
 
 
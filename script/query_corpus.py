@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Concordance search in the gold standard by form, lemma, simple and detailed
+analysis. Prints the matches in a keyword in context (KWIC) view. The index
+is built into the corpus cache on first use.
+"""
+
+from argparse import ArgumentParser
+from itertools import islice
+from pathlib import Path
+import sys
+
+from gold_standard.cache import INDEXED_FIELDS, load_cache
+from gold_standard.query import kwic, search
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus-dir', '-c', type=Path,
+                        default=Path(__file__).parent.parent / 'corpus' / 'Morph annotated',
+                        help='the directory of the XML files (the Morph '
+                             'annotated corpus).')
+    for field in INDEXED_FIELDS:
+        parser.add_argument(f'--{field}', help=f'the {field} to search for.')
+    parser.add_argument('--genre', '-g', action='append',
+                        help='restrict the search to a genre (e.g. Legal); '
+                             'can be specified more than once.')
+    parser.add_argument('--regex', '-r', action='store_true',
+                        help='the values are regular expressions that must '
+                             'match the whole string.')
+    parser.add_argument('--width', '-w', type=int, default=40,
+                        help='the width of the left and right context '
+                             '(default: 40).')
+    parser.add_argument('--limit', '-l', type=int,
+                        help='the maximum number of matches to print.')
+    parser.add_argument('--count', action='store_true',
+                        help='only print the number of matches.')
+    args = parser.parse_args()
+
+    args.constraints = {field: getattr(args, field) for field in INDEXED_FIELDS
+                        if getattr(args, field) is not None}
+    if not args.constraints:
+        parser.error('At least one of {} is required.'.format(
+            ', '.join(f'--{field}' for field in INDEXED_FIELDS)))
+    return args
+
+
+def main():
+    args = parse_arguments()
+    cache = load_cache(args.corpus_dir)
+    matches = search(cache, args.constraints, args.genre, args.regex)
+    if args.count:
+        print(sum(1 for _ in matches))
+        return
+
+    for token_idx in islice(matches, args.limit):
+        hit = kwic(cache, token_idx, args.width)
+        print(hit.file, hit.sentence_id, hit.token_id,
+              f'{hit.left:>{args.width}} [{hit.keyword}] {hit.right}',
+              sep='\t')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except BrokenPipeError:
+        # E.g. piped to head
+        sys.stderr.close()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Prints elements (e.g. sentences or tokens) of a TEI XML file by xml:id,
+without parsing the whole file. Useful for looking up the tokens listed by
+annotator_agreement.py.
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+
+from gold_standard.offsets import OffsetIndex
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('xml_file', type=Path, help='the TEI XML file.')
+    parser.add_argument('xml_ids', nargs='+', metavar='xml_id',
+                        help='the xml:id of an element (e.g. s12 or t345).')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    index = OffsetIndex(args.xml_file)
+    missing = False
+    for xml_id in args.xml_ids:
+        try:
+            print(index.fragment(xml_id).decode('utf-8'))
+        except KeyError:
+            print(f'No element with xml:id {xml_id} in {args.xml_file}',
+                  file=sys.stderr)
+            missing = True
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
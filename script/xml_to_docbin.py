@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Exports the gold standard TEI XML files to sharded spaCy DocBin (.spacy)
+files for training, divided into train / dev / test splits.
+
+Each sentence becomes a Doc with the gold standard lemmas and tags (see
+gold_standard.spacy.gold_doc). The splits are deterministic, stratified by
+genre and keyed by document (see gold_standard.splits). The output directory
+has a subdirectory per split with the shards (which can be passed to
+`spacy train` as is) and a splits.tsv that lists the split of each file.
+"""
+
+from argparse import ArgumentParser
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from pathlib import Path
+
+from spacy.tokens import DocBin
+from spacy.vocab import Vocab
+from tqdm import tqdm
+
+from gold_standard.cache import corpus_files
+from gold_standard.spacy import gold_doc
+from gold_standard.splits import DEFAULT_RATIOS, SPLITS, assign_splits, document_id, genre
+from gold_standard.tei import iter_sentences
+
+
+def parse_arguments():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('input_dir', type=Path,
+                        help='the directory of the XML files (e.g. the Morph '
+                             'annotated corpus).')
+    parser.add_argument('output_dir', type=Path,
+                        help='the output directory.')
+    parser.add_argument('--ratios', '-r', type=float, nargs=len(SPLITS),
+                        default=DEFAULT_RATIOS, metavar=tuple(s.upper() for s in SPLITS),
+                        help='the relative sizes of the splits (default: {}).'.format(
+                            ' '.join(map(str, DEFAULT_RATIOS))))
+    parser.add_argument('--seed', default='',
+                        help='changes the assignment of the documents to the '
+                             'splits (default: empty).')
+    parser.add_argument('--shard-size', '-s', type=int, default=5000,
+                        help='the number of sentences (Docs) per shard; a '
+                             'shard is written once it reaches this size '
+                             '(default: 5000).')
+    parser.add_argument('--processes', '-P', type=int, default=1,
+                        help='number of worker processes to use (max is the '
+                             'num of cores, default: 1)')
+    args = parser.parse_args()
+
+    num_procs = len(os.sched_getaffinity(0))
+    if args.processes < 1 or args.processes > num_procs:
+        parser.error('Number of processes must be between 1 and {}'.format(
+            num_procs))
+    if args.shard_size < 1:
+        parser.error('The shard size must be positive.')
+    if not args.input_dir.is_dir():
+        parser.error(f'{args.input_dir} is not a directory.')
+    return args
+
+
+def convert_file(input_file: Path) -> bytes:
+    """
+    Converts the sentences of _input_file_ to a serialized DocBin. The user
+    data of each Doc contains the document, sentence and token ids.
+    """
+    vocab = Vocab()
+    doc_bin = DocBin(store_user_data=True)
+    doc_id = document_id(input_file)
+    for sentence in iter_sentences(input_file):
+        if sentence.tokens:
+            doc = gold_doc(vocab, sentence)
+            doc.user_data['document_id'] = doc_id
+            doc.user_data['sentence_id'] = sentence.id
+            doc.user_data['token_ids'] = [token.id for token in sentence.tokens]
+            doc_bin.add(doc)
+    return doc_bin.to_bytes()
+
+
+class ShardWriter:
+    """
+    Collects the Docs of a split and writes them to
+    ``{output_dir}/{split}/{split}-{n:04d}.spacy`` in shards of (at least)
+    _shard_size_ Docs.
+    """
+    def __init__(self, output_dir: Path, split: str, shard_size: int):
+        self.output_dir = output_dir / split
+        self.split = split
+        self.shard_size = shard_size
+        self.num_shards = 0
+        self.num_docs = 0
+        self._doc_bin = DocBin(store_user_data=True)
+
+    def add(self, doc_bin: DocBin):
+        """Adds the Docs in _doc_bin_ and writes the shard if it is full."""
+        self._doc_bin.merge(doc_bin)
+        self.num_docs += len(doc_bin)
+        if len(self._doc_bin) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the current shard, if it is not empty."""
+        if len(self._doc_bin) == 0:
+            return
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._doc_bin.to_disk(
+            self.output_dir / f'{self.split}-{self.num_shards:04d}.spacy')
+        self.num_shards += 1
+        self._doc_bin = DocBin(store_user_data=True)
+
+
+def ordered_map(executor: ProcessPoolExecutor, fn: Callable, items: Iterable,
+                window: int) -> Iterator:
+    """
+    Like :meth:`executor.map`, but at most _window_ items are submitted
+    ahead, so the results waiting to be consumed do not pile up.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def export(input_dir: Path, output_dir: Path, ratios=DEFAULT_RATIOS,
+           seed: str = '', shard_size: int = 5000, processes: int = 1):
+    """
+    Exports the XML files under _input_dir_ into _output_dir_. The files are
+    processed in a stable order, so the output does not depend on
+    _processes_.
+    """
+    input_files = corpus_files(input_dir)
+    splits = assign_splits(input_files, ratios, seed)
+    writers = {split: ShardWriter(output_dir, split, shard_size) for split in SPLITS}
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / 'splits.tsv', 'wt', encoding='utf-8') as outf:
+        print('file', 'document', 'genre', 'split', sep='\t', file=outf)
+        for input_file in input_files:
+            print(input_file.relative_to(input_dir), document_id(input_file),
+                  genre(input_file), splits[input_file], sep='\t', file=outf)
+
+    if processes == 1:
+        converted = map(convert_file, input_files)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('fork'))
+        converted = ordered_map(executor, convert_file, input_files, 2 * processes)
+    try:
+        for input_file, doc_bin_bytes in tqdm(zip(input_files, converted),
+                                              total=len(input_files), unit='file'):
+            writers[splits[input_file]].add(
+                DocBin(store_user_data=True).from_bytes(doc_bin_bytes))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    for writer in writers.values():
+        writer.flush()
+    return writers
+
+
+def main():
+    args = parse_arguments()
+    writers = export(args.input_dir, args.output_dir, args.ratios, args.seed,
+                     args.shard_size, args.processes)
+    for split, writer in writers.items():
+        print(f'{split}: {writer.num_docs} sentences in {writer.num_shards} shards')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,73 +4,700 @@
 """
 Reads a level2 TEI XML (i.e. one that already has the emtsv annotations),
 parses it with spaCy and converts it into a CoNLL-U file.
+
+If the input is a directory, all .xml files under it are converted into the
+output directory, keeping the directory layout (e.g. the genres). The model
+is loaded only once and the files are distributed among the worker
+processes; with one process, the next files are read while spaCy
+processes the current one.
+
+The progress is recorded in a manifest in the output directory (or next to
+the output file), so an interrupted conversion continues where it stopped
+when it is restarted with the same arguments; use --restart to start over.
+
+With --serve, the script runs as a local HTTP server that keeps the model
+loaded, so converting a file does not have to wait for the model to load.
+The same command line with --server (instead of --serve) then converts the
+files with the server; see ConversionHandler for the protocol.
+
+With --gold, the lemmas and tags are not predicted by spaCy, but taken from
+the gold standard annotation in the XML, and only the dependency parser runs.
+The UPOS and the features are then converted from the emMorph tags by a
+simple mapping, which only approximates the UD version of the corpus (that
+was converted with emmorph2ud2).
 """
 
 from argparse import ArgumentParser
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from http.client import HTTPConnection, HTTPException
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from itertools import count, islice
+import json
+import multiprocessing
 import os
 from pathlib import Path
+import shutil
+from socketserver import ForkingMixIn
 import sys
+from typing import Any, BinaryIO
+from urllib.parse import parse_qs, urlencode, urlsplit
 
-# import spacy_conll  # noqa
 import spacy
+from spacy.tokens import Doc
+from tqdm import tqdm
+
+from gold_standard.backend import ParseError
+from gold_standard.cache import file_hash
+from gold_standard.checkpoint import Manifest, Progress
+from gold_standard.spacy import (
+    CONLLU_FIELDS, WhitespaceTokenizer, conllu_lines, disable_taggers, gold_doc
+)
+from gold_standard.splits import document_id
+from gold_standard.tei import Sentence, iter_sentences
+from gold_standard.utils import BoundedReader, SerialWorker, resident_memory
+
 
-from gold_standard.spacy import WhitespaceTokenizer
-from gold_standard.tei import sentences
-from gold_standard.utils import split_gen
+# The default maximum number of sentences read but not yet written
+DEFAULT_MAX_IN_FLIGHT = 1000
+# The number of sentences between two checkpoints in the progress manifest
+CHECKPOINT_EVERY = 100
+# The default number of files read ahead
+DEFAULT_PREFETCH = 2
+# The default address of the conversion server
+DEFAULT_ADDRESS = '127.0.0.1:8765'
 
 
 def parse_arguments():
     parser = ArgumentParser(description=__doc__)
-    parser.add_argument('input_file', type=Path, help='the input .xml file.')
-    parser.add_argument('output_file', type=Path,
-                        help='the output .conllu file.')
+    parser.add_argument('input_file', type=Path, nargs='?',
+                        help='the input .xml file or a directory of them.')
+    parser.add_argument('output_file', type=Path, nargs='?',
+                        help='the output .conllu file or directory.')
     parser.add_argument('--spacy-model', '-s', default='hu_core_news_lg',
                         help='the spaCy model to load (hu_core_news_lg).')
     parser.add_argument('--processes', '-P', type=int, default=1,
                         help='number of worker processes to use (max is the '
                              'num of cores, default: 1)')
+    parser.add_argument('--gold', '-g', action='store_true',
+                        help='use the gold standard lemmas and tags from the '
+                             'XML and only run the dependency parser; UPOS '
+                             'and FEATS are converted from the tags by an '
+                             'approximate mapping.')
+    parser.add_argument('--max-in-flight', '-m', type=int,
+                        default=DEFAULT_MAX_IN_FLIGHT,
+                        help='the maximum number of sentences read, but not '
+                             'yet written, in total: the prefetched files and, '
+                             'when converting a directory with -P, the worker '
+                             'processes share it (with --serve, it applies '
+                             'per request). It bounds the memory use '
+                             f'(default: {DEFAULT_MAX_IN_FLIGHT}).')
+    parser.add_argument('--prefetch', '-k', type=int, default=DEFAULT_PREFETCH,
+                        help='the number of files to read ahead when '
+                             'converting a directory with one process '
+                             f'(default: {DEFAULT_PREFETCH}).')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the progress of the previous runs and '
+                             'convert everything again.')
+    server_group = parser.add_mutually_exclusive_group()
+    server_group.add_argument('--serve', nargs='?', const=DEFAULT_ADDRESS,
+                              metavar='ADDRESS',
+                              help='run as a server that keeps the model '
+                                   'loaded and converts files on request, '
+                                   f'on ADDRESS (default: {DEFAULT_ADDRESS}).')
+    server_group.add_argument('--server', nargs='?', const=DEFAULT_ADDRESS,
+                              metavar='ADDRESS',
+                              help='convert with the server running on ADDRESS '
+                                   f'(default: {DEFAULT_ADDRESS}) instead of '
+                                   'loading the model.')
     args = parser.parse_args()
 
+    if args.serve is not None:
+        if args.input_file is not None or args.output_file is not None:
+            parser.error('The server gets the input and the output with the '
+                         'requests; they cannot be given with --serve.')
+    elif args.input_file is None or args.output_file is None:
+        parser.error('The input and the output are required, unless --serve '
+                     'is specified.')
+    for address in (args.serve, args.server):
+        if address is not None:
+            try:
+                parse_address(address)
+            except ValueError:
+                # E.g. the input given right after --serve
+                parser.error(f'Invalid address {address} (expected host:port).')
+
     num_procs = len(os.sched_getaffinity(0))
     if args.processes < 1 or args.processes > num_procs:
         parser.error('Number of processes must be between 1 and {}'.format(
             num_procs))
+    if args.serve is None and args.input_file.is_dir() and args.output_file.is_file():
+        parser.error('The output must be a directory if the input is.')
+    if args.prefetch < 0:
+        parser.error('The number of files to prefetch cannot be negative.')
+    try:
+        if args.serve is not None or not args.input_file.is_dir():
+            batch_size_for(args.processes, args.max_in_flight)
+        elif args.processes == 1:
+            # As many files as can be in flight at a time (see num_readers)
+            batch_size_for(1, args.max_in_flight, args.prefetch + 2)
+        else:
+            # Each worker process converts a file at a time
+            batch_size_for(1, args.max_in_flight, args.processes)
+    except ValueError as e:
+        parser.error(str(e))
     return args
 
 
-def main():
-    args = parse_arguments()
+def load_model(model_name: str, gold: bool = False):
+    """
+    Loads the spaCy model and sets it up for the conversion.
 
+    :param gold: disable the components that would overwrite the gold
+                 standard annotation (see :func:`disable_taggers`).
+    """
     # Using a white space tokenizer, as the data is already tokenized.
     try:
-        nlp = spacy.load(args.spacy_model)
+        nlp = spacy.load(model_name)
     except OSError:
-        print(f'Model {args.spacy_model} is not available. Please download it '
+        print(f'Model {model_name} is not available. Please download it '
               'via `python -m spacy download <model>` or via pip.')
         sys.exit(-1)
     nlp.tokenizer = WhitespaceTokenizer(nlp.vocab)
-    nlp.add_pipe("conll_formatter")
-
-    words_it, ids_it = split_gen(sentences(args.input_file))
-    parsed_it = nlp.pipe(words_it, n_process=args.processes,
-                         batch_size=args.processes * 5)
-
-    file_stem = args.input_file.stem.rsplit('_', 1)[0]
-    out_line = f'{file_stem}/{{}}\t{{}}'
-    args.output_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(args.output_file, 'wt', encoding='utf-8') as outf:
-        print('ID', 'FORM', 'LEMMA', 'UPOS', 'XPOS', 'FEATS', 'HEAD',
-              'DEPREL', 'DEPS', 'MISC', sep='\t', file=outf)
-        for doc, ids in zip(parsed_it, ids_it):
-            t_ids = iter(ids)
-            for line in doc._.conll_str.split('\n'):
-                # spaCy might split sentences, which might or might not be
-                # correct, but we want to keep the original, already gold
-                # standard split
-                if line:
-                    print(out_line.format(next(t_ids), line.split('\t', 1)[1]),
-                          file=outf)
-            print(file=outf)
+    if gold:
+        disable_taggers(nlp)
+    return nlp
+
+
+def batch_size_for(processes: int, max_in_flight: int, readers: int = 1) -> int:
+    """
+    The batch size for ``nlp.pipe()``. Before it returns the first Doc, spaCy
+    reads one batch ahead with a single process and two batches per process
+    with more, which must fit into the share of a reader, if _max_in_flight_
+    sentences are shared by _readers_ readers.
+    """
+    batches_ahead = 1 if processes == 1 else 2 * processes
+    if max_in_flight // readers < batches_ahead:
+        raise ValueError(f'At least {batches_ahead * readers} sentences must be '
+                         f'allowed in flight with {processes} processes and '
+                         f'{readers} files read at a time.')
+    return min(processes * 5, max_in_flight // readers // batches_ahead)
+
+
+def num_readers(num_files: int, prefetch: int) -> int:
+    """
+    The number of files whose sentences can be in flight at the same time in
+    :func:`convert_files`: the prefetched ones, the one spaCy is working on
+    and the end of the previous one (spaCy reads ahead across files).
+    """
+    return max(1, min(num_files, prefetch + 2))
+
+
+def run_settings(nlp, gold: bool) -> dict[str, Any]:
+    """The settings the output depends on, for the progress manifest."""
+    meta = nlp.meta
+    return {'model': f'{meta["lang"]}_{meta["name"]}-{meta["version"]}',
+            'gold': gold}
+
+
+def manifest_file_for(output: Path) -> Path:
+    """
+    The progress manifest of a conversion into _output_: a file in the
+    output directory, or next to the output file.
+    """
+    if output.is_dir():
+        return output / '.progress.jsonl'
+    return output.parent / f'.{output.name}.progress.jsonl'
+
+
+class ConlluOutput:
+    """
+    The CoNLL-U output of an input file. The sentences are written into a
+    ``.part`` file, which is renamed to _output_file_ when it is complete.
+
+    If a _manifest_ is given, the progress is recorded in it every
+    _checkpoint_every_ sentences; an output that is already complete
+    (:attr:`up_to_date`) is not converted again and a partial one is
+    continued from :attr:`num_sentences`, unless the input file or the
+    _settings_ have changed since.
+    """
+    def __init__(self, input_file: Path, output_file: Path, settings: dict[str, Any],
+                 manifest: Manifest | None = None, manifest_key: str | None = None,
+                 checkpoint_every: int = CHECKPOINT_EVERY):
+        """
+        :param manifest_key: the key of the input file in the manifest; its
+                             name by default.
+        """
+        self.input_file = input_file
+        self.output_file = output_file
+        self.part_file = output_file.with_name(output_file.name + '.part')
+        self.file_stem = document_id(input_file)
+        self.settings = settings
+        self.manifest = manifest
+        self.manifest_key = manifest_key or input_file.name
+        self.checkpoint_every = checkpoint_every
+        self.sha1 = file_hash(input_file)
+        self.up_to_date = False
+        # The sentences and bytes written so far
+        self.num_sentences, self.num_bytes = 0, 0
+        self._outf = None
+
+        if manifest is not None:
+            checkpoint = manifest.get(self.manifest_key, self.sha1, settings)
+            if checkpoint is not None:
+                if checkpoint.done and output_file.is_file():
+                    self.up_to_date = True
+                elif (not checkpoint.done and self.part_file.is_file() and
+                        self.part_file.stat().st_size >= checkpoint.bytes):
+                    self.num_sentences = checkpoint.sentences
+                    self.num_bytes = checkpoint.bytes
+
+    def _record(self, done: bool = False):
+        if self.manifest is not None:
+            self.manifest.record(Progress(self.manifest_key, self.sha1, self.settings,
+                                          self.num_sentences, self.num_bytes, done))
+
+    def _open(self):
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        if self.num_bytes > 0:
+            # Drop whatever was written after the last checkpoint
+            os.truncate(self.part_file, self.num_bytes)
+            self._outf = open(self.part_file, 'at', encoding='utf-8')
+        else:
+            self._outf = open(self.part_file, 'wt', encoding='utf-8')
+            print(*CONLLU_FIELDS, sep='\t', file=self._outf)
+
+    def write(self, sentence: str):
+        """Writes the CoNLL-U lines of the next sentence."""
+        if self._outf is None:
+            self._open()
+        self._outf.write(sentence)
+        self._outf.write('\n\n')
+        self.num_sentences += 1
+        if self.num_sentences % self.checkpoint_every == 0:
+            # tell() flushes the buffer
+            self.num_bytes = self._outf.tell()
+            self._record()
+
+    def close(self):
+        """Finishes the output after the last sentence."""
+        if self._outf is None:
+            self._open()
+        self.num_bytes = self._outf.tell()
+        self._outf.close()
+        os.replace(self.part_file, self.output_file)
+        self._record(True)
+
+
+def _sentences_with_ids(input_file: Path | BinaryIO) -> Iterator[tuple[Sentence, list[str]]]:
+    for sentence in iter_sentences(input_file):
+        if sentence.tokens:
+            yield sentence, [token.id for token in sentence.tokens]
+
+
+def make_doc(nlp, sentence: Sentence, gold: bool = False) -> Doc:
+    """
+    Creates the Doc of _sentence_ from its tokens. Must be called from the
+    thread that runs _nlp_, as the vocab is not thread-safe.
+
+    :param gold: add the gold standard lemmas and tags (see :func:`gold_doc`).
+    """
+    if gold:
+        return gold_doc(nlp.vocab, sentence)
+    return nlp.tokenizer.from_tokens(sentence.tokens)
+
+
+def convert_files(nlp, jobs: Iterable[tuple[Path, Path, str | None]],
+                  processes: int = 1, gold: bool = False,
+                  max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                  prefetch: int = DEFAULT_PREFETCH, progress: bool = False,
+                  manifest: Manifest | None = None,
+                  checkpoint_every: int = CHECKPOINT_EVERY) -> int:
+    """
+    Converts TEI XML files to CoNLL-U. The sentences of all files are passed
+    through spaCy as a single stream, together with their token ids.
+
+    Reading the input and writing the output overlap with spaCy: the next
+    _prefetch_ files are read in background threads while spaCy works on the
+    current one, and the output is written by a separate writer thread. At
+    most _max_in_flight_ sentences are read but not yet written in total,
+    regardless of the number of processes: the files whose sentences can be
+    in flight at the same time (see :func:`num_readers`) get an equal share
+    of it, and a sentence counts until the writer thread has written it.
+
+    :param jobs: (input file, output file, manifest key) triples; see
+                 :class:`ConlluOutput` about the manifest.
+    :param gold: pass the sentences to _nlp_ as Docs that already have the
+                 gold standard lemmas and tags (see :func:`gold_doc`).
+    :param progress: show a progress bar with the number of sentences in
+                     flight and the resident memory.
+    :return: the number of files converted (at least partially).
+    """
+    settings = run_settings(nlp, gold)
+    jobs = list(jobs)
+    readers = num_readers(len(jobs), prefetch)
+    batch_size = batch_size_for(processes, max_in_flight, readers)
+    max_in_flight_per_reader = max_in_flight // readers
+    # The outputs (with their readers) whose sentences are or were passed to
+    # spaCy, but are not closed yet, in order. The context of the sentences
+    # is (the number of the output, the token ids), as it is also sent to the
+    # worker processes.
+    started = deque()
+    started_by_number = {}
+    numbers = count()
+
+    def file_inputs(output, reader):
+        number = next(numbers)
+        started.append(number)
+        started_by_number[number] = output, reader
+        for sentence, ids in reader:
+            yield make_doc(nlp, sentence, gold), (number, ids)
+
+    def close_first():
+        output, _ = started_by_number.pop(started.popleft())
+        writer.submit(output.close)
+
+    def inputs():
+        prefetched = deque()
+        for input_file, output_file, manifest_key in jobs:
+            output = ConlluOutput(input_file, output_file, settings, manifest,
+                                  manifest_key, checkpoint_every)
+            if output.up_to_date:
+                continue
+            reader = BoundedReader(islice(_sentences_with_ids(input_file),
+                                          output.num_sentences, None),
+                                   max_in_flight_per_reader).start()
+            prefetched.append((output, reader))
+            if len(prefetched) > prefetch:
+                yield from file_inputs(*prefetched.popleft())
+        while prefetched:
+            yield from file_inputs(*prefetched.popleft())
+
+    def write(output, reader, text):
+        output.write(text)
+        reader.done()
+
+    num_closed = 0
+    # The pending writes are limited by the readers: their sentences are
+    # marked as processed only once written
+    with SerialWorker() as writer, \
+            tqdm(nlp.pipe(inputs(), as_tuples=True, n_process=processes,
+                          batch_size=batch_size),
+                 unit='sent', disable=not progress) as bar:
+        for i, (doc, (number, ids)) in enumerate(bar, 1):
+            # The files before the one of doc are complete
+            while started[0] != number:
+                close_first()
+                num_closed += 1
+            output, reader = started_by_number[number]
+            # spaCy might split sentences, which might or might not be
+            # correct, but we want to keep the original, already gold
+            # standard split
+            writer.submit(write, output, reader, '\n'.join(conllu_lines(
+                doc, [f'{output.file_stem}/{t_id}' for t_id in ids])))
+            if progress and i % 100 == 0:
+                bar.set_postfix(files=num_closed,
+                                in_flight=sum(r.in_flight for _, r in
+                                              started_by_number.values()),
+                                rss=f'{resident_memory() >> 20}M', refresh=False)
+        while started:
+            close_first()
+            num_closed += 1
+    return num_closed
+
+
+def convert_file(nlp, input_file: Path, output_file: Path, processes: int = 1,
+                 gold: bool = False, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 progress: bool = False, manifest: Manifest | None = None,
+                 manifest_key: str | None = None,
+                 checkpoint_every: int = CHECKPOINT_EVERY) -> bool:
+    """
+    Converts a single TEI XML file to CoNLL-U; see :func:`convert_files`.
+
+    :return: whether the file had to be converted (at least partially).
+    """
+    return convert_files(nlp, [(input_file, output_file, manifest_key)],
+                         processes, gold, max_in_flight, 0, progress, manifest,
+                         checkpoint_every) > 0
+
+
+# The model in the worker processes of convert_directory(). It is loaded in
+# the parent and inherited via fork, so it is only loaded once.
+_worker_nlp = None
+
+
+def _convert_in_worker(input_file: Path, output_file: Path,
+                       kwargs: dict[str, Any]) -> Path:
+    convert_file(_worker_nlp, input_file, output_file, **kwargs)
+    return input_file
+
+
+def convert_directory(nlp, input_dir: Path, output_dir: Path, processes: int = 1,
+                      gold: bool = False,
+                      max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                      manifest: Manifest | None = None,
+                      prefetch: int = DEFAULT_PREFETCH):
+    """
+    Converts all .xml files under _input_dir_ into the same layout under
+    _output_dir_. With one process, the files are converted as a single
+    stream (see :func:`convert_files`); otherwise each worker process
+    converts whole files, with an equal share of _max_in_flight_. The files
+    are keyed by their path relative to _input_dir_ in the _manifest_ (see
+    :class:`ConlluOutput`).
+    """
+    global _worker_nlp
+
+    # Largest first, so that the workers finish at about the same time
+    input_files = sorted(input_dir.glob('**/*.xml'),
+                         key=lambda f: f.stat().st_size, reverse=True)
+    jobs = [(input_file,
+             output_dir / input_file.relative_to(input_dir).with_suffix('.conllu'),
+             {'gold': gold, 'max_in_flight': max_in_flight // processes,
+              'manifest': manifest,
+              'manifest_key': str(input_file.relative_to(input_dir))})
+            for input_file in input_files]
+
+    if processes == 1:
+        convert_files(nlp, [(input_file, output_file, kwargs['manifest_key'])
+                            for input_file, output_file, kwargs in jobs],
+                      gold=gold, max_in_flight=max_in_flight, prefetch=prefetch,
+                      progress=True, manifest=manifest)
+        return
+
+    _worker_nlp = nlp
+    with ProcessPoolExecutor(processes,
+                             mp_context=multiprocessing.get_context('fork')) as executor:
+        futures = [executor.submit(_convert_in_worker, *job) for job in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures), unit='file'):
+            future.result()
+
+
+def iter_conllu(nlp, input_file: Path | BinaryIO, file_stem: str, gold: bool = False,
+                max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> Iterator[str]:
+    """
+    Converts a TEI XML file (or file object) and yields its CoNLL-U output
+    piece by piece: the header line first, then the sentences.
+
+    :param file_stem: the prefix of the token ids (the document id).
+    """
+    yield '\t'.join(CONLLU_FIELDS) + '\n'
+    reader = BoundedReader(_sentences_with_ids(input_file), max_in_flight)
+    inputs = ((make_doc(nlp, sentence, gold), ids) for sentence, ids in reader)
+    for doc, ids in nlp.pipe(inputs, as_tuples=True,
+                             batch_size=batch_size_for(1, max_in_flight)):
+        yield '\n'.join(conllu_lines(doc, [f'{file_stem}/{t_id}' for t_id in ids])) + '\n\n'
+        reader.done()
+
+
+class ConversionServer(ForkingMixIn, HTTPServer):
+    """
+    Keeps the model loaded and converts files on request (see --serve).
+    Each request is handled in a child process forked from the server, so
+    the model is shared, and at most _processes_ requests are handled at a
+    time.
+    """
+    def __init__(self, address: tuple[str, int], nlp, model_name: str,
+                 gold: bool, processes: int, max_in_flight: int):
+        super().__init__(address, ConversionHandler)
+        self.nlp = nlp
+        self.model_name = model_name
+        self.gold = gold
+        self.max_children = processes
+        self.max_in_flight = max_in_flight
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """
+    The requests of :class:`ConversionServer`:
+
+    - ``GET /status``: the settings of the server as JSON;
+    - ``POST /convert?path=...``: converts a file on the server;
+    - ``POST /convert?name=...``: converts the XML in the request body
+      (``name`` is the file name, which determines the token id prefix).
+
+    The optional ``model`` and ``gold`` parameters must match those of the
+    server. The CoNLL-U output is streamed with chunked transfer encoding;
+    if the conversion fails midway, the connection is closed without the
+    terminating chunk.
+    """
+    protocol_version = 'HTTP/1.1'
+    server: ConversionServer
+
+    def _send_text(self, code: int, text: str, content_type: str = 'text/plain'):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/status':
+            self._send_text(404, f'Unknown path {self.path}')
+            return
+        self._send_text(200, json.dumps({
+            'model': self.server.model_name, 'gold': self.server.gold,
+            'processes': self.server.max_children
+        }), 'application/json')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path != '/convert':
+            self._send_text(404, f'Unknown path {url.path}')
+            return
+        if params.get('model', self.server.model_name) != self.server.model_name:
+            self._send_text(409, f'The server runs {self.server.model_name}, '
+                                 f'not {params["model"]}.')
+            return
+        if params.get('gold', str(int(self.server.gold))) != str(int(self.server.gold)):
+            self._send_text(409, 'The server runs {} --gold.'.format(
+                'with' if self.server.gold else 'without'))
+            return
+
+        if 'path' in params:
+            input_file = Path(params['path'])
+            if not input_file.is_file():
+                self._send_text(404, f'No such file: {input_file}')
+                return
+            name = input_file.name
+        else:
+            input_file = BytesIO(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            name = params.get('name', 'input.xml')
+
+        pieces = iter_conllu(self.server.nlp, input_file, document_id(Path(name)),
+                             self.server.gold, self.server.max_in_flight)
+        try:
+            # The header and the first sentence, so that most errors (e.g.
+            # a missing root element) are reported with a proper status
+            first = [next(pieces), next(pieces, '')]
+        except ParseError as e:
+            self._send_text(400, f'Invalid XML: {e}')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            self._write_chunk(''.join(first))
+            for piece in pieces:
+                self._write_chunk(piece)
+        except Exception as e:
+            self.log_error('Conversion of %s failed: %r', name, e)
+            self.close_connection = True
+            return
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Splits a host:port address."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def serve(nlp, model_name: str, address: str = DEFAULT_ADDRESS, gold: bool = False,
+          processes: int = 1, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+    """Runs the conversion server until it is interrupted."""
+    with ConversionServer(parse_address(address), nlp, model_name, gold,
+                          processes, max_in_flight) as server:
+        print(f'Serving {model_name} on http://{address}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def convert_remote(address: str, input_file: Path, output_file: Path,
+                   model_name: str | None = None, gold: bool = False):
+    """
+    Converts _input_file_ with a running conversion server (see
+    :func:`serve`). The output is written atomically, like with
+    :func:`convert_file`.
+
+    :raise ConnectionError: if the server could not convert the file.
+    """
+    params = {'path': str(input_file.resolve()), 'gold': int(gold)}
+    if model_name is not None:
+        params['model'] = model_name
+    connection = HTTPConnection(*parse_address(address))
+    try:
+        connection.request('POST', f'/convert?{urlencode(params)}')
+        response = connection.getresponse()
+        if response.status != 200:
+            raise ConnectionError(f'{input_file}: {response.read().decode("utf-8")}')
+        part_file = output_file.with_name(output_file.name + '.part')
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(part_file, 'wb') as outf:
+                # Raises IncompleteRead if the conversion failed midway
+                shutil.copyfileobj(response, outf)
+        except (HTTPException, OSError) as e:
+            part_file.unlink(missing_ok=True)
+            raise ConnectionError(f'{input_file}: {e!r}') from e
+        os.replace(part_file, output_file)
+    finally:
+        connection.close()
+
+
+def convert_remote_directory(address: str, input_dir: Path, output_dir: Path,
+                             model_name: str | None = None, gold: bool = False,
+                             processes: int = 1):
+    """
+    Converts all .xml files under _input_dir_ into the same layout under
+    _output_dir_ with a running conversion server, sending _processes_
+    requests at a time.
+    """
+    jobs = [(input_file,
+             output_dir / input_file.relative_to(input_dir).with_suffix('.conllu'))
+            for input_file in sorted(input_dir.glob('**/*.xml'))]
+    with ThreadPoolExecutor(processes) as executor:
+        futures = [executor.submit(convert_remote, address, input_file, output_file,
+                                   model_name, gold)
+                   for input_file, output_file in jobs]
+        for future in tqdm(as_completed(futures), total=len(futures), unit='file'):
+            future.result()
+
+
+def main():
+    args = parse_arguments()
+    if args.server is not None:
+        try:
+            if args.input_file.is_dir():
+                convert_remote_directory(args.server, args.input_file,
+                                         args.output_file, args.spacy_model,
+                                         args.gold, args.processes)
+            else:
+                convert_remote(args.server, args.input_file, args.output_file,
+                               args.spacy_model, args.gold)
+        except ConnectionError as e:
+            print(f'Conversion with the server at {args.server} failed: {e}',
+                  file=sys.stderr)
+            sys.exit(1)
+        return
+
+    nlp = load_model(args.spacy_model, args.gold)
+    if args.serve is not None:
+        serve(nlp, args.spacy_model, args.serve, args.gold, args.processes,
+              args.max_in_flight)
+        return
+    if args.input_file.is_dir():
+        args.output_file.mkdir(parents=True, exist_ok=True)
+        manifest = Manifest(manifest_file_for(args.output_file), args.restart)
+        convert_directory(nlp, args.input_file, args.output_file, args.processes,
+                          args.gold, args.max_in_flight, manifest, args.prefetch)
+    else:
+        manifest = Manifest(manifest_file_for(args.output_file), args.restart)
+        if not convert_file(nlp, args.input_file, args.output_file, args.processes,
+                            args.gold, args.max_in_flight, progress=True,
+                            manifest=manifest):
+            print(f'{args.output_file} is up to date.')
 
 
 if __name__ == '__main__':
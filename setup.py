@@ -52,8 +52,15 @@ setup(name='gold-standard',
           'scripts/xml_to_spacy.py',
       ],
       install_requires=[
+          'numpy',
           'spacy',
           'tqdm',
       ],
+      extras_require={
+          # Faster XML parsing (see gold_standard/backend.py)
+          'lxml': ['lxml'],
+          # Parquet output of annotator_agreement.py --confusion
+          'parquet': ['pyarrow'],
+      },
       # zip_safe=False,
       use_2to3=False)